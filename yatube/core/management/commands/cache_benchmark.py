@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = (
+    ('LocMemCache', 'django.core.cache.backends.locmem.LocMemCache', ''),
+    ('FileBasedCache',
+     'django.core.cache.backends.filebased.FileBasedCache', 'files'),
+    ('SQLiteCache', 'core.cache.SQLiteCache', 'cache.sqlite3'),
+)
+
+
+def run_worker(backend, location, options, seed):
+    """Читает фрагменты, при промахе «рендерит» и кладёт их в кеш."""
+    cache = import_string(backend)(location, {
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': options['keys'] * 2},
+    })
+    rnd = random.Random(seed)
+    value = b'x' * options['size']
+    hits = 0
+    started = perf_counter()
+    for _ in range(options['ops']):
+        key = f'fragment:{int(rnd.random() ** 2 * options["keys"])}'
+        if cache.get(key) is None:
+            cache.set(key, value)
+        else:
+            hits += 1
+    return hits, perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает LocMemCache, FileBasedCache и SQLiteCache при '
+        'одновременной работе нескольких процессов-воркеров.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--ops', type=int, default=5000,
+            help='Операций чтения на одного воркера')
+        parser.add_argument(
+            '--keys', type=int, default=500,
+            help='Число разных фрагментов')
+        parser.add_argument(
+            '--size', type=int, default=4096,
+            help='Размер фрагмента в байтах')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"backend":>15} {"ops/s":>10} {"hit rate":>9}')
+        for name, backend, location in BACKENDS:
+            directory = tempfile.mkdtemp()
+            try:
+                ops, hit_rate = self.measure(
+                    backend, os.path.join(directory, location), options)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            self.stdout.write(f'{name:>15} {ops:>10.0f} {hit_rate:>9.1%}')
+
+    def measure(self, backend, location, options):
+        context = multiprocessing.get_context('fork')
+        with context.Pool(options['workers']) as pool:
+            results = pool.starmap(run_worker, [
+                (backend, location, options, seed)
+                for seed in range(options['workers'])
+            ])
+        total = options['ops'] * options['workers']
+        hits = sum(hits for hits, _ in results)
+        elapsed = max(elapsed for _, elapsed in results)
+        return total / elapsed, hits / total
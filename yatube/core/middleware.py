@@ -0,0 +1,52 @@
+import time
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from . import page_cache
+
+
+class AnonymousPageCacheMiddleware:
+    """Полностраничный кеш GET-запросов анонимных посетителей.
+
+    Кешируются только ответы, которые view пометила суррогатными
+    ключами через ``page_cache.tag``; сигналы моделей сбрасывают
+    страницы по этим ключам через ``page_cache.purge``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated):
+            return self.get_response(request)
+        path = request.get_full_path()
+        entry = page_cache.lookup(path)
+        if entry is not None:
+            page_cache.count('hits')
+            response = HttpResponse(
+                entry['content'], content_type=entry['content_type'])
+            for header, value in entry.get('headers', {}).items():
+                response[header] = value
+            response[page_cache.SURROGATE_HEADER] = ' '.join(entry['keys'])
+            response = get_conditional_response(
+                request,
+                etag=response.get('ETag'),
+                last_modified=parse_http_date_safe(
+                    response.get('Last-Modified', '')),
+                response=response,
+            )
+            response['X-Page-Cache'] = 'HIT'
+            return response
+        rendered_at = time.time()
+        response = self.get_response(request)
+        if (response.status_code == 200
+                and page_cache.SURROGATE_HEADER in response
+                and not response.streaming
+                and not response.cookies):
+            page_cache.count('misses')
+            page_cache.store(path, response, rendered_at)
+            response['X-Page-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+
+SURROGATE_HEADER = 'Surrogate-Key'
+PAGE_KEY = 'page_cache:page:{}'
+PURGED_KEY = 'page_cache:purged:{}'
+VALIDATORS = ('ETag', 'Last-Modified')
+STATS_KEY = 'page_cache:stats:{}'
+STATS = ('hits', 'misses', 'purges')
+FLUSH_EVERY = 50
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+
+
+def surrogate_key(key):
+    """Ключ в заголовке: без пробелов, которые разделяют ключи."""
+    return quote(key, safe=':')
+
+
+def _purged_key(key):
+    return PURGED_KEY.format(hashlib.md5(key.encode()).hexdigest())
+
+
+def tag(response, *keys):
+    """Помечает ответ суррогатными ключами для страничного кеша."""
+    current = response.get(SURROGATE_HEADER, '').split()
+    response[SURROGATE_HEADER] = ' '.join(dict.fromkeys(
+        current + [surrogate_key(key) for key in keys if key]))
+    return response
+
+
+def purge(*keys):
+    """Сбрасывает все страницы, помеченные любым из ключей."""
+    keys = [surrogate_key(key) for key in keys if key]
+    if not keys:
+        return
+    now = time.time()
+    cache.set_many({_purged_key(key): now for key in keys}, None)
+    count('purges', len(keys))
+
+
+def _page_key(path):
+    return PAGE_KEY.format(hashlib.md5(path.encode()).hexdigest())
+
+
+def lookup(path):
+    """Закешированная страница или None, если она сброшена или её нет.
+
+    Страница актуальна, если ни один её суррогатный ключ не сбрасывался
+    после начала рендера. Время сброса ключа, вытесненное из кеша,
+    считается неизвестным, и страница тогда рендерится заново.
+    """
+    entry = cache.get(_page_key(path))
+    if entry is None:
+        return None
+    purged = cache.get_many([_purged_key(key) for key in entry['keys']])
+    if len(purged) < len(entry['keys']) or any(
+            purged_at >= entry['rendered_at']
+            for purged_at in purged.values()):
+        return None
+    return entry
+
+
+def store(path, response, rendered_at):
+    keys = response[SURROGATE_HEADER].split()
+    for key in keys:
+        cache.add(_purged_key(key), 0, None)
+    cache.set(_page_key(path), {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'headers': {
+            header: response[header]
+            for header in VALIDATORS if header in response
+        },
+        'keys': keys,
+        'rendered_at': rendered_at,
+    }, settings.PAGE_CACHE_TIMEOUT)
+
+
+def count(stat, amount=1):
+    """Копит счётчики в процессе и сбрасывает их в общий кеш пачками."""
+    with _pending_lock:
+        _pending[stat] += amount
+        if sum(_pending.values()) < FLUSH_EVERY:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+    _flush(pending)
+
+
+def _flush(pending):
+    for stat, amount in pending.items():
+        key = STATS_KEY.format(stat)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, amount, None)
+
+
+def stats():
+    """Общие счётчики попаданий, промахов и сбросов всех процессов."""
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    _flush(pending)
+    values = cache.get_many([STATS_KEY.format(stat) for stat in STATS])
+    return {stat: values.get(STATS_KEY.format(stat), 0) for stat in STATS}
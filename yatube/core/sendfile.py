@@ -0,0 +1,26 @@
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+
+
+def send_file(storage, name):
+    """Ответ с файлом из хранилища.
+
+    При заданном SENDFILE_HEADER тело отдаёт фронтовой сервер: для
+    ``X-Accel-Redirect`` (nginx) в заголовке внутренний адрес
+    SENDFILE_URL + имя, для ``X-Sendfile`` (Apache, lighttpd) путь на
+    диске. Без настройки файл читает сам Django.
+    """
+    content_type = (
+        mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    header = settings.SENDFILE_HEADER
+    if not header:
+        return FileResponse(storage.open(name), content_type=content_type)
+    response = HttpResponse(content_type=content_type)
+    if header == 'X-Accel-Redirect':
+        response[header] = settings.SENDFILE_URL + quote(name)
+    else:
+        response[header] = storage.path(name)
+    return response
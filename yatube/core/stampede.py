@@ -0,0 +1,47 @@
+import math
+import random
+import time
+
+from django.core.cache import cache
+
+LOCK_TIMEOUT = 10
+POLL_INTERVAL = 0.05
+
+
+def get_or_compute(key, compute, timeout, beta=1.0):
+    """Значение из кеша с защитой от одновременного пересчёта.
+
+    Запись хранит время своего вычисления и срок годности. Пересчёт
+    начинается с вероятностью, растущей к концу срока (XFetch), а
+    выполняет его только процесс, захвативший блокировку через add().
+    Остальные в это время отдают устаревшее значение, которое лежит
+    в кеше ещё один ``timeout`` после срока годности, или ждут
+    первого результата, если значения нет совсем.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires = entry
+        early = delta * beta * math.log(1 - random.random())
+        if time.time() - early < expires:
+            return value
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, True, LOCK_TIMEOUT):
+        try:
+            started = time.time()
+            value = compute()
+            finished = time.time()
+            cache.set(
+                key, (value, finished - started, finished + timeout),
+                timeout * 2)
+        finally:
+            cache.delete(lock_key)
+        return value
+    if entry is not None:
+        return entry[0]
+    deadline = time.time() + LOCK_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return compute()
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла - SHA-256 его содержимого.
+
+    ``posts/photo.jpg`` сохраняется как ``posts/ab/cd/<hash>.jpg``.
+    Повторная загрузка тех же байтов получает имя уже лежащего файла,
+    поэтому одинаковые картинки хранятся в одном экземпляре. Время
+    изменения такого файла обновляется, чтобы сборщик мусора не удалил
+    его как давно осиротевший.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if not self.exists(name):
+            try:
+                return super().save(name, content, max_length)
+            except FileExistsError:
+                pass
+        os.utime(self.path(name))
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        """Не подбирает свободное имя: файл с этим именем - те же байты.
+
+        Если тот же файл одновременно сохраняет другой запрос, ошибка
+        доходит до save(), и он возвращает уже занятое имя.
+        """
+        if self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension)
+
+
+def iter_files(storage, directory, after=''):
+    """Лениво обходит файлы каталога в порядке путей, начиная после ``after``.
+
+    Каталоги, целиком лежащие до ``after``, не читаются, поэтому
+    прерванный обход продолжается без повторного просмотра.
+    """
+    after_parts = after.split('/') if after else []
+    directories, files = storage.listdir(directory)
+    entries = sorted(
+        [(name, True) for name in directories]
+        + [(name, False) for name in files])
+    for name, is_directory in entries:
+        path = f'{directory}/{name}' if directory else name
+        parts = path.split('/')
+        if is_directory:
+            if parts >= after_parts[:len(parts)]:
+                yield from iter_files(storage, path, after)
+        elif parts > after_parts:
+            yield path
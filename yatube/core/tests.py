@@ -1,8 +1,157 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.template import Context, Template
 from django.test import TestCase
 
+from .cache import SQLiteCache
+from .stampede import get_or_compute
+from .storage import HASHED_NAME, ContentAddressedStorage
+
 
 class ViewTestClass(TestCase):
     def test_error_page(self):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_basic_operations(self):
+        """Кеш поддерживает set/get/add/incr/delete."""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertTrue(self.cache.add('new', 'value'))
+        self.cache.add('counter', 1)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(
+            self.cache.get_many(['key', 'new', 'missing']),
+            {'key': {'value': 1}, 'new': 'value'})
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_expired_values_are_missing(self):
+        """Просроченная запись не возвращается и может быть заменена add."""
+        self.cache.set('key', 'value', timeout=0)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'fresh'))
+        self.assertEqual(self.cache.get('key'), 'fresh')
+
+    def test_shared_between_instances(self):
+        """Записи видны другому экземпляру с тем же файлом."""
+        self.cache.set('key', 'value')
+        other = self.make_cache()
+        self.assertEqual(other.get('key'), 'value')
+        other.add('counter', 0)
+        other.incr('counter')
+        self.assertEqual(self.cache.get('counter'), 1)
+
+    def test_lru_eviction_by_size(self):
+        """При превышении MAX_SIZE вытесняются давно не читанные записи."""
+        cache = self.make_cache(MAX_SIZE=4000, CULL_FREQUENCY=2)
+        cache.set('old', b'x' * 1000)
+        cache.set('hot', b'x' * 1000)
+        cache.LRU_RESOLUTION = 0
+        for i in range(3):
+            cache.set(f'filler_{i}', b'x' * 1000)
+            cache.get('hot')
+        self.assertIsNone(cache.get('old'))
+        self.assertIsNotNone(cache.get('hot'))
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_same_content_stored_once(self):
+        """Одинаковые байты сохраняются в один файл с именем по хешу."""
+        first = self.storage.save('posts/a.JPG', ContentFile(b'meme'))
+        second = self.storage.save('posts/b.jpg', ContentFile(b'meme'))
+        other = self.storage.save('posts/c.jpg', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, HASHED_NAME)
+        self.assertTrue(first.startswith('posts/'))
+        self.assertTrue(first.endswith('.jpg'))
+        self.assertEqual(len(os.listdir(
+            os.path.join(self.directory, os.path.dirname(first)))), 1)
+
+    def test_concurrent_save_keeps_hashed_name(self):
+        """Файл, появившийся после проверки exists(), не получает суффикс."""
+        first = self.storage.save('posts/a.jpg', ContentFile(b'meme'))
+        exists = mock.Mock(side_effect=[False, False, True])
+        with mock.patch.object(ContentAddressedStorage, 'exists', exists):
+            second = self.storage.save('posts/b.jpg', ContentFile(b'meme'))
+        self.assertEqual(second, first)
+        self.assertEqual(len(os.listdir(
+            os.path.join(self.directory, os.path.dirname(first)))), 1)
+
+
+class StampedeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_computed_once(self):
+        """Свежее значение берётся из кеша без пересчёта."""
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_served_while_locked(self):
+        """Пока другой воркер пересчитывает, отдаётся старое значение."""
+        cache.set('key', ('stale', 0.1, time.time() - 1), 60)
+        cache.add('key:lock', True, 60)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 'stale')
+        self.assertEqual(self.calls, 0)
+
+    def test_expired_value_recomputed_by_lock_holder(self):
+        """Просроченное значение пересчитывает владелец блокировки."""
+        cache.set('key', ('stale', 0.1, time.time() - 1), 60)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+        self.assertFalse(cache.get('key:lock'))
+
+    def test_early_recomputation(self):
+        """Незадолго до истечения срока пересчёт начинается заранее."""
+        cache.set('key', ('old', 10.0, time.time() + 1), 60)
+        with mock.patch('core.stampede.random.random', return_value=0.9):
+            self.assertEqual(get_or_compute('key', self.compute, 60), 1)
+
+    def test_template_tag(self):
+        """Тег cache из stampede_cache кеширует фрагмент."""
+        template = Template(
+            '{% load stampede_cache %}'
+            '{% cache 60 fragment key %}{{ value }}{% endcache %}')
+        first = template.render(Context({'key': 1, 'value': 'first'}))
+        second = template.render(Context({'key': 1, 'value': 'second'}))
+        other = template.render(Context({'key': 2, 'value': 'other'}))
+        self.assertEqual(first, 'first')
+        self.assertEqual(second, 'first')
+        self.assertEqual(other, 'other')
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Group, Post
+from .search import match_query, matching_ids
 
 
 @admin.register(Post)
@@ -11,6 +12,13 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по полнотекстовому индексу вместо LIKE по всей таблице."""
+        match = match_query(search_term)
+        if not match:
+            return queryset, False
+        return queryset.filter(pk__in=matching_ids(match)), False
+
 
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
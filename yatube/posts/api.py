@@ -0,0 +1,196 @@
+import orjson
+from django.http import HttpResponse
+
+from core.page_cache import tag
+
+from .feed_cache import (INDEX_FEED, cached_page, conditional_feed,
+                         feed_version, group_feed, page_surrogate_keys,
+                         profile_feed)
+from .models import Group, Post, User
+from .paginator import MAX_INT, paginate
+from .timeline import HybridFeedPaginator, feed, pulled_authors
+from .views import (POSTS_PER_PAGE, group_version, index_version,
+                    profile_version)
+
+BATCH_LIMIT = 100
+
+
+def author_data(author):
+    return {
+        'id': author.pk,
+        'username': author.username,
+        'full_name': author.get_full_name(),
+    }
+
+
+def group_data(group):
+    return {'id': group.pk, 'slug': group.slug, 'title': group.title}
+
+
+FIELDS = {
+    'id': lambda post: post.pk,
+    'text': lambda post: post.text,
+    'pub_date': lambda post: post.pub_date,
+    'image': lambda post: post.image.url if post.image else None,
+    'comments_count': lambda post: post.comments_count,
+    'author': lambda post: author_data(post.author),
+    'group': lambda post: group_data(post.group) if post.group_id else None,
+}
+
+
+def json_response(data, status=200):
+    return HttpResponse(
+        orjson.dumps(data), status=status, content_type='application/json')
+
+
+def error(message, status):
+    return json_response({'error': message}, status)
+
+
+def requested_fields(request):
+    """Поля из ``?fields=a,b``; None, если среди них есть неизвестные."""
+    value = request.GET.get('fields', '')
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    if not fields:
+        return list(FIELDS)
+    if any(name not in FIELDS for name in fields):
+        return None
+    return fields
+
+
+def page_link(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params.pop('page', None)
+    params['cursor'] = cursor
+    return f'{request.path}?{params.urlencode()}'
+
+
+def serialize(posts, fields):
+    getters = [(name, FIELDS[name]) for name in fields]
+    return [{name: getter(post) for name, getter in getters} for post in posts]
+
+
+def feed_response(request, page_obj, fields):
+    """Страница ленты в JSON без форм и промежуточных сериализаторов.
+
+    Словари собираются прямо из постов страницы, автор и группа уже
+    подтянуты ``select_related``, а datetime кодирует сам orjson.
+    """
+    return json_response({
+        'results': serialize(page_obj, fields),
+        'next': page_link(request, page_obj.next_cursor),
+        'previous': page_link(request, page_obj.previous_cursor),
+    })
+
+
+def unknown_fields():
+    return error(f'Допустимые поля: {", ".join(FIELDS)}', 400)
+
+
+@conditional_feed(index_version)
+def index(request):
+    fields = requested_fields(request)
+    if fields is None:
+        return unknown_fields()
+    post_list = Post.objects.select_related('author', 'group')
+    page_obj = cached_page(
+        request,
+        feed_version(INDEX_FEED),
+        lambda: paginate(request, post_list, POSTS_PER_PAGE)
+    )
+    return tag(
+        feed_response(request, page_obj, fields),
+        'feed:index', *page_surrogate_keys(page_obj))
+
+
+@conditional_feed(group_version)
+def group_posts(request, slug):
+    fields = requested_fields(request)
+    if fields is None:
+        return unknown_fields()
+    group = Group.objects.filter(slug=slug).first()
+    if group is None:
+        return error('Группа не найдена', 404)
+    post_list = group.posts.select_related('author', 'group')
+    page_obj = cached_page(
+        request,
+        feed_version(group_feed(group.pk)),
+        lambda: paginate(request, post_list, POSTS_PER_PAGE)
+    )
+    return tag(
+        feed_response(request, page_obj, fields),
+        f'group:{group.slug}', *page_surrogate_keys(page_obj))
+
+
+@conditional_feed(profile_version)
+def profile(request, username):
+    fields = requested_fields(request)
+    if fields is None:
+        return unknown_fields()
+    author = User.objects.filter(username=username).first()
+    if author is None:
+        return error('Пользователь не найден', 404)
+    post_list = author.posts.select_related('author', 'group')
+    page_obj = cached_page(
+        request,
+        feed_version(profile_feed(author.pk)),
+        lambda: paginate(request, post_list, POSTS_PER_PAGE)
+    )
+    return tag(
+        feed_response(request, page_obj, fields),
+        f'author:{author.username}', *page_surrogate_keys(page_obj))
+
+
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return error('Нужна авторизация', 401)
+    fields = requested_fields(request)
+    if fields is None:
+        return unknown_fields()
+    page_obj = paginate(
+        request,
+        feed(request.user),
+        POSTS_PER_PAGE,
+        paginator_class=HybridFeedPaginator,
+        pulled=pulled_authors(request.user)
+    )
+    return feed_response(request, page_obj, fields)
+
+
+def requested_ids(request):
+    """Id из ``?ids=3,1,2`` без повторов в порядке запроса или None.
+
+    Id вне диапазона 1..2^63-1 не могут быть ключами в базе и
+    считаются ошибкой запроса, как и не числа.
+    """
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',')]
+    except ValueError:
+        return None
+    if any(not 0 < pk <= MAX_INT for pk in ids):
+        return None
+    return list(dict.fromkeys(ids))
+
+
+def posts_batch(request):
+    """Посты по списку id одним запросом ``id__in`` в порядке списка.
+
+    Автор и группа подтягиваются тем же запросом, число комментариев
+    хранится в самом посте. Ненайденные id перечисляются в ``missing``.
+    """
+    fields = requested_fields(request)
+    if fields is None:
+        return unknown_fields()
+    ids = requested_ids(request)
+    if ids is None:
+        return error('ids - список положительных id через запятую', 400)
+    if len(ids) > BATCH_LIMIT:
+        return error(f'Не больше {BATCH_LIMIT} id за запрос', 400)
+    posts = Post.objects.select_related('author', 'group').in_bulk(ids)
+    return json_response({
+        'results': serialize(
+            (posts[pk] for pk in ids if pk in posts), fields),
+        'missing': [pk for pk in ids if pk not in posts],
+    })
@@ -0,0 +1,244 @@
+import bisect
+import logging
+import threading
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.urls import NoReverseMatch, reverse
+
+from .models import Group, User
+
+VERSION_KEY = 'autocomplete:version'
+CHANGE_KEY = 'autocomplete:change:{}'
+CHANGE_TIMEOUT = 60 * 60 * 24
+MAX_REPLAY = 1000
+TRIGRAM = 3
+RESULTS_LIMIT = 10
+USER_FIELDS = ('username', 'first_name', 'last_name')
+
+logger = logging.getLogger(__name__)
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def normalize(text):
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def trigrams(text):
+    return {text[i:i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}
+
+
+class AutocompleteIndex:
+    """Индекс подстрок имён пользователей и групп в памяти процесса.
+
+    Запрос от трёх символов ищется пересечением множеств триграмм
+    с проверкой вхождения; первыми идут совпадения с начала слова,
+    затем более короткие подписи. Более короткий запрос - бинарным
+    поиском по отсортированному списку слов, и его работа ограничена
+    ``limit`` первыми по алфавиту словами.
+    """
+
+    def __init__(self, version=0):
+        self.version = version
+        self.entries = {}
+        self.grams = defaultdict(set)
+        self.words = []
+        self.lock = threading.RLock()
+
+    def add(self, key, entry, terms):
+        with self.lock:
+            self.remove(key)
+            for word in self._insert(key, entry, terms):
+                bisect.insort(self.words, word)
+
+    def extend(self, items):
+        """Добавляет новые записи пачкой, сортируя слова один раз."""
+        with self.lock:
+            for key, entry, terms in items:
+                self.words.extend(self._insert(key, entry, terms))
+            self.words.sort()
+
+    def _insert(self, key, entry, terms):
+        terms = [normalize(term) for term in terms if term]
+        self.entries[key] = (entry, terms)
+        words = []
+        for term in terms:
+            for gram in trigrams(term):
+                self.grams[gram].add(key)
+            words.extend((word, key) for word in term.split())
+        return words
+
+    def remove(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return
+            _, terms = self.entries.pop(key)
+            for term in terms:
+                for gram in trigrams(term):
+                    self.grams[gram].discard(key)
+                    if not self.grams[gram]:
+                        del self.grams[gram]
+                for word in term.split():
+                    position = bisect.bisect_left(self.words, (word, key))
+                    if self.words[position:position + 1] == [(word, key)]:
+                        del self.words[position]
+
+    def search(self, query, limit=RESULTS_LIMIT):
+        query = normalize(query)
+        if not query:
+            return []
+        with self.lock:
+            if len(query) < TRIGRAM:
+                keys = self._prefixed(query, limit)
+            else:
+                keys = sorted(
+                    self._containing(query),
+                    key=lambda key: self._rank(key, query))[:limit]
+            return [self.entries[key][0] for key in keys]
+
+    def _prefixed(self, query, limit):
+        keys = {}
+        position = bisect.bisect_left(self.words, (query,))
+        while position < len(self.words) and len(keys) < limit:
+            word, key = self.words[position]
+            if not word.startswith(query):
+                break
+            keys[key] = None
+            position += 1
+        return list(keys)
+
+    def _containing(self, query):
+        postings = sorted(
+            (self.grams.get(gram, set()) for gram in trigrams(query)),
+            key=len)
+        candidates = set.intersection(*postings)
+        return {
+            key for key in candidates
+            if any(query in term for term in self.entries[key][1])
+        }
+
+    def _rank(self, key, query):
+        entry, terms = self.entries[key]
+        prefix = any(
+            term.startswith(query) or f' {query}' in term for term in terms)
+        return (not prefix, len(entry['label']), entry['label'])
+
+
+def url(view_name, value):
+    """Адрес страницы или None, если значение не проходит в маршрут."""
+    try:
+        return reverse(view_name, args=[value])
+    except NoReverseMatch:
+        return None
+
+
+def user_entry(user):
+    full_name = f'{user.first_name} {user.last_name}'.strip()
+    entry = {
+        'type': 'user',
+        'label': full_name or user.username,
+        'value': user.username,
+        'url': url('posts:profile', user.username),
+    }
+    return ('user', user.pk), entry, [user.username, full_name]
+
+
+def group_entry(group):
+    entry = {
+        'type': 'group',
+        'label': group.title,
+        'value': group.slug,
+        'url': url('posts:group_list', group.slug),
+    }
+    return ('group', group.pk), entry, [group.title, group.slug]
+
+
+def build():
+    """Собирает индекс по всем пользователям и группам.
+
+    Версия читается до обхода таблиц: изменения, внесённые во время
+    обхода, потом повторно применяются из журнала, а это безопасно.
+    """
+    index = AutocompleteIndex(cache.get(VERSION_KEY, 0))
+    index.extend(map(
+        user_entry, User.objects.only(*USER_FIELDS).iterator()))
+    index.extend(map(
+        group_entry, Group.objects.only('title', 'slug').iterator()))
+    return index
+
+
+def replay(index, version):
+    """Применяет к индексу изменения из журнала до ``version``.
+
+    Возвращает False, если часть журнала уже вытеснена из кеша.
+    """
+    keys = [
+        CHANGE_KEY.format(number)
+        for number in range(index.version + 1, version + 1)
+    ]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return False
+    for key in keys:
+        change_key, entry, terms = changes[key]
+        if entry is None:
+            index.remove(change_key)
+        else:
+            index.add(change_key, entry, terms)
+    index.version = version
+    return True
+
+
+def get_index():
+    """Индекс процесса, догнавший журнал изменений в общем кеше.
+
+    Каждое изменение после коммита получает следующий номер версии
+    и записывается в кеш под этим номером. Процесс, отставший от
+    версии, применяет недостающие изменения точечно. Целиком индекс
+    собирается только при холодном старте или если журнал неполон:
+    вытеснен из кеша, слишком длинен или версия начата заново.
+    """
+    global _index
+    version = cache.get(VERSION_KEY, 0)
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _build_lock:
+        index = _index
+        if index is None or not (
+                index.version <= version <= index.version + MAX_REPLAY
+                and replay(index, version)):
+            _index = build()
+    return _index
+
+
+def warm():
+    """Строит индекс при старте процесса, чтобы не тратить на это запрос.
+
+    Если база ещё не готова, например не применены миграции, индекс
+    соберётся при первом запросе.
+    """
+    try:
+        get_index()
+    except DatabaseError:
+        logger.warning(
+            'Индекс автодополнения будет собран при первом запросе',
+            exc_info=True)
+
+
+def search(query, limit=RESULTS_LIMIT):
+    return get_index().search(query, limit)
+
+
+def update(key, entry=None, terms=()):
+    """Пишет изменение в журнал после коммита; ``entry=None`` - удаление."""
+    transaction.on_commit(lambda: _apply(key, entry, terms))
+
+
+def _apply(key, entry, terms):
+    cache.add(VERSION_KEY, 0, None)
+    version = cache.incr(VERSION_KEY)
+    cache.set(CHANGE_KEY.format(version), (key, entry, terms), CHANGE_TIMEOUT)
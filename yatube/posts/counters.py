@@ -0,0 +1,101 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import AuthorCounters, Comment, Follow, ImageBlob, Post, User
+
+
+def subquery_count(model, field, ref='pk'):
+    """Коррелированный COUNT строк ``model``, ссылающихся на ``ref``."""
+    rows = model.objects.filter(
+        **{field: OuterRef(ref)}
+    ).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows), 0)
+
+
+def author_counters(author_id):
+    """Счётчики автора; при первом обращении считаются по таблицам."""
+    counters, _ = AuthorCounters.objects.get_or_create(
+        author_id=author_id,
+        defaults={
+            'posts_count': Post.objects.filter(author_id=author_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=author_id).count(),
+        }
+    )
+    return counters
+
+
+def counters_for(author):
+    """Счётчики, подгруженные через select_related('counters')."""
+    try:
+        return author.counters
+    except AuthorCounters.DoesNotExist:
+        return author_counters(author.pk)
+
+
+def change_author(author_id, **deltas):
+    """Сдвигает счётчики автора, если строка счётчиков уже есть."""
+    AuthorCounters.objects.filter(author_id=author_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def change_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta)
+
+
+def change_image_refs(name, delta):
+    """Сдвигает число ссылок на файл; строка создаётся по таблице постов."""
+    if not name:
+        return
+    updated = ImageBlob.objects.filter(name=name).update(
+        refcount=F('refcount') + delta)
+    if not updated:
+        ImageBlob.objects.get_or_create(
+            name=name,
+            defaults={'refcount': Post.objects.filter(image=name).count()})
+
+
+def reconcile():
+    """Пересчитывает все счётчики пачкой, возвращает число исправлений."""
+    AuthorCounters.objects.bulk_create(
+        (AuthorCounters(author_id=pk)
+         for pk in User.objects.filter(
+             counters__isnull=True).values_list('pk', flat=True).iterator()),
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    posts = Post.objects.annotate(actual=subquery_count(Comment, 'post'))
+    fixed_posts = posts.filter(~Q(comments_count=F('actual'))).count()
+    Post.objects.update(comments_count=subquery_count(Comment, 'post'))
+
+    authors = User.objects.annotate(
+        actual_posts=subquery_count(Post, 'author'),
+        actual_followers=subquery_count(Follow, 'author'),
+    ).filter(
+        ~Q(counters__posts_count=F('actual_posts'))
+        | ~Q(counters__followers_count=F('actual_followers'))
+    )
+    fixed_authors = authors.count()
+    AuthorCounters.objects.update(
+        posts_count=subquery_count(Post, 'author', 'author'),
+        followers_count=subquery_count(Follow, 'author', 'author'),
+    )
+
+    unknown_images = Post.objects.exclude(image='').exclude(
+        image__in=ImageBlob.objects.values('name')
+    ).order_by().values_list('image', flat=True).distinct()
+    ImageBlob.objects.bulk_create(
+        (ImageBlob(name=name) for name in unknown_images.iterator()),
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    blobs = ImageBlob.objects.annotate(
+        actual=subquery_count(Post, 'image', 'name'))
+    fixed_images = blobs.filter(~Q(refcount=F('actual'))).count()
+    ImageBlob.objects.update(refcount=subquery_count(Post, 'image', 'name'))
+    return {
+        'posts': fixed_posts,
+        'authors': fixed_authors,
+        'images': fixed_images,
+    }
@@ -0,0 +1,73 @@
+import csv
+
+import orjson
+
+from .models import Comment, Post
+
+CHUNK_SIZE = 2000
+COLUMNS = ('type', 'id', 'post', 'group', 'created', 'text', 'image')
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def author_rows(author):
+    """Все посты, затем все комментарии автора по одной строке.
+
+    Записи читаются ``.iterator()`` кусками по CHUNK_SIZE как кортежи,
+    без создания моделей, поэтому память не растёт с размером аккаунта.
+    """
+    posts = Post.objects.filter(author=author).order_by('pk').values_list(
+        'pk', 'group__slug', 'pub_date', 'text', 'image')
+    for pk, group, pub_date, text, image in posts.iterator(CHUNK_SIZE):
+        yield {
+            'type': 'post',
+            'id': pk,
+            'post': None,
+            'group': group,
+            'created': pub_date,
+            'text': text,
+            'image': image or None,
+        }
+    comments = Comment.objects.filter(author=author).order_by(
+        'pk').values_list('pk', 'post_id', 'created', 'text')
+    for pk, post_id, created, text in comments.iterator(CHUNK_SIZE):
+        yield {
+            'type': 'comment',
+            'id': pk,
+            'post': post_id,
+            'group': None,
+            'created': created,
+            'text': text,
+            'image': None,
+        }
+
+
+class Echo:
+    """Файл для csv.writer, который возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield orjson.dumps(row) + b'\n'
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS).encode()
+    for row in rows:
+        row['created'] = row['created'].isoformat()
+        yield writer.writerow([row[column] for column in COLUMNS]).encode()
+
+
+def export(author, export_format):
+    """Поток байтовых строк выгрузки автора в ``ndjson`` или ``csv``."""
+    rows = author_rows(author)
+    if export_format == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
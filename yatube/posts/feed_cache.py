@@ -0,0 +1,117 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.views.decorators.http import condition
+
+from core.stampede import get_or_compute
+
+VERSION_KEY = 'feed_version:{}'
+FEED_PAGE_TIMEOUT = 20
+GLOBAL_FEED = 'all'
+INDEX_FEED = 'index'
+
+
+def group_feed(group_id):
+    return f'group:{group_id}'
+
+
+def profile_feed(author_id):
+    return f'profile:{author_id}'
+
+
+def feed_version(feed):
+    """Версия фрагментов ленты для ключа ``{% cache %}``.
+
+    Складывается из глобальной версии и версии самой ленты, поэтому
+    после bump() старые фрагменты просто перестают находиться в кеше.
+    Версия - время последнего изменения в наносекундах, поэтому
+    вытесненная из кеша версия не совпадёт со старым значением.
+    """
+    keys = [VERSION_KEY.format(GLOBAL_FEED), VERSION_KEY.format(feed)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return '.'.join([feed, *(str(versions[key]) for key in keys)])
+
+
+def bump(*feeds):
+    """Инвалидирует фрагменты перечисленных лент."""
+    now = time.time_ns()
+    cache.set_many({VERSION_KEY.format(feed): now for feed in feeds}, None)
+
+
+def version_modified(version):
+    """Время последнего изменения ленты, записанное в её версии."""
+    stamp = max(int(part) for part in version.split('.')[1:])
+    return datetime.fromtimestamp(stamp / 10 ** 9, tz=timezone.utc)
+
+
+def viewer_tag(request):
+    """Часть ETag, зависящая от того, кто смотрит страницу.
+
+    У авторизованных на странице свои кнопки и формы с CSRF-токеном.
+    Секрет токена меняется при каждом входе, поэтому он тоже входит
+    в ETag: иначе после повторного входа браузер получил бы 304 и
+    отправил бы форму со старым токеном.
+    """
+    if not request.user.is_authenticated:
+        return '0'
+    get_token(request)
+    secret = request.META['CSRF_COOKIE']
+    return f'{request.user.pk}-{hashlib.md5(secret.encode()).hexdigest()}'
+
+
+def conditional_feed(version_func):
+    """Отвечает 304 без рендера, если версия ленты страницы не менялась.
+
+    ``version_func`` получает аргументы view и возвращает версию ленты
+    или None, если страницы нет. В ETag входит ``viewer_tag()``.
+    """
+    def version(request, *args, **kwargs):
+        if not hasattr(request, 'conditional_version'):
+            request.conditional_version = version_func(
+                request, *args, **kwargs)
+        return request.conditional_version
+
+    def etag(request, *args, **kwargs):
+        current = version(request, *args, **kwargs)
+        return current and f'{viewer_tag(request)}.{current}'
+
+    def last_modified(request, *args, **kwargs):
+        current = version(request, *args, **kwargs)
+        return current and version_modified(current)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def bump_post_feeds(author_id, *group_ids):
+    bump(
+        INDEX_FEED,
+        profile_feed(author_id),
+        *(group_feed(group_id) for group_id in group_ids if group_id),
+    )
+
+
+def cached_page(request, version, compute):
+    """Страница ленты из кеша с защитой от одновременного пересчёта."""
+    params = f'{request.GET.get("page", "")}|{request.GET.get("cursor", "")}'
+    digest = hashlib.md5(params.encode()).hexdigest()
+    return get_or_compute(
+        f'feed_page:{version}:{digest}', compute, FEED_PAGE_TIMEOUT)
+
+
+def post_surrogate_keys(post):
+    """Суррогатные ключи страничного кеша для поста на странице."""
+    keys = [f'post:{post.pk}', f'author:{post.author.username}']
+    if post.group_id:
+        keys.append(f'group:{post.group.slug}')
+    return keys
+
+
+def page_surrogate_keys(page_obj):
+    return [key for post in page_obj for key in post_surrogate_keys(post)]
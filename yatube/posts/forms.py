@@ -1,6 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
 from .models import Comment, Post
+from .uploads import normalize_image
 
 
 class PostForm(forms.ModelForm):
@@ -18,6 +20,12 @@ class PostForm(forms.ModelForm):
             'image': 'Загрузите картинку к посту'
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return normalize_image(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
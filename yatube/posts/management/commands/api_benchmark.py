@@ -0,0 +1,87 @@
+from time import perf_counter
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from posts import api, views
+from posts.models import Follow, Group, Post, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает HTML-ленты и их JSON API по времени ответа, размеру '
+        'и числу запросов. Все данные создаются в транзакции '
+        'и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--posts', type=int, default=30,
+            help='Сколько постов в каждой ленте')
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Сколько раз повторять каждый замер')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                reader, author, group = self.create_data(options['posts'])
+                endpoints = [
+                    ('index', (), AnonymousUser()),
+                    ('group_posts', (group.slug,), AnonymousUser()),
+                    ('profile', (author.username,), AnonymousUser()),
+                    ('follow_index', (), reader),
+                ]
+                rows = [
+                    (name, kind, *self.measure(
+                        view, args, user, options['repeat']))
+                    for name, args, user in endpoints
+                    for kind, view in (
+                        ('html', getattr(views, name)),
+                        ('json', getattr(api, name)),
+                    )
+                ]
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(
+            f'{"view":>13} {"kind":>5} {"ms":>8} {"bytes":>8} '
+            f'{"queries":>8}')
+        for name, kind, elapsed, size, queries in rows:
+            self.stdout.write(
+                f'{name:>13} {kind:>5} {elapsed:>8.2f} {size:>8} '
+                f'{queries:>8}')
+
+    def create_data(self, count):
+        reader = User.objects.create(username='api_bench_reader')
+        author = User.objects.create(
+            username='api_bench_author', first_name='Api', last_name='Bench')
+        group = Group.objects.create(
+            title='api bench', slug='api-bench', description='benchmark')
+        Follow.objects.create(user=reader, author=author)
+        for i in range(count):
+            Post.objects.create(
+                author=author, group=group, text=f'benchmark post {i}')
+        return reader, author, group
+
+    def measure(self, view, args, user, repeat):
+        """Среднее время, размер ответа и число запросов на запрос."""
+        factory = RequestFactory()
+        elapsed = 0
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(repeat):
+                request = factory.get('/')
+                request.user = user
+                started = perf_counter()
+                response = view(request, *args)
+                elapsed += perf_counter() - started
+        return (
+            elapsed * 1000 / repeat, len(response.content),
+            len(queries) // repeat)
@@ -0,0 +1,148 @@
+import time
+from itertools import islice
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core.storage import iter_files
+from posts.models import ImageBlob, Post
+
+CURSOR_KEY = 'collect_media:cursor'
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки постов, на которые не ссылается ни один пост, '
+        'вместе с их миниатюрами. Сначала забирает файлы, счётчик ссылок '
+        'которых упал до нуля, затем обходит хранилище пачками и '
+        'запоминает позицию, поэтому может работать порциями через --limit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов сверять с постами одним запросом')
+        parser.add_argument(
+            '--limit', type=int, default=0,
+            help='Сколько файлов просмотреть за запуск, 0 - до конца')
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать, ничего не удаляя')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать обход сначала, забыв сохранённую позицию')
+        parser.add_argument(
+            '--released', action='store_true',
+            help='Только файлы с нулевым счётчиком ссылок, без обхода')
+
+    def handle(self, *args, **options):
+        field = Post._meta.get_field('image')
+        self.storage = field.storage
+        self.dry_run = options['dry_run']
+        self.deadline = time.time() - options['min_age']
+        orphans, reclaimed = self.collect_released(options['batch_size'])
+        if options['released']:
+            prefix = 'Будет удалено' if self.dry_run else 'Удалено'
+            self.stdout.write(self.style.SUCCESS(
+                f'{prefix} сирот: {orphans}, '
+                f'освобождено байт: {reclaimed}.'))
+            return
+        cursor = '' if options['restart'] else cache.get(CURSOR_KEY, '')
+        directory = field.upload_to.strip('/')
+        files = (
+            iter_files(self.storage, directory, cursor)
+            if self.storage.exists(directory) else iter([]))
+        remaining = options['limit'] or None
+        scanned = 0
+        finished = False
+        while remaining is None or remaining > 0:
+            size = options['batch_size']
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            batch = list(islice(files, size))
+            if not batch:
+                finished = True
+                break
+            referenced = set(Post.objects.filter(
+                image__in=batch).values_list('image', flat=True))
+            for name in batch:
+                if name not in referenced and self.is_stale(name):
+                    orphans += 1
+                    reclaimed += self.collect(name)
+            scanned += len(batch)
+            cursor = batch[-1]
+            if not self.dry_run:
+                cache.set(CURSOR_KEY, cursor, None)
+        if finished and not self.dry_run:
+            cache.delete(CURSOR_KEY)
+        prefix = 'Будет удалено' if self.dry_run else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Просмотрено файлов: {scanned}. {prefix} сирот: {orphans}, '
+            f'освобождено байт: {reclaimed}.'))
+        if not finished:
+            self.stdout.write(f'Обход остановлен после {cursor}')
+
+    def collect_released(self, batch_size):
+        """Файлы из ImageBlob с нулевым счётчиком ссылок.
+
+        Счётчик сверяется с постами: разошедшийся из-за сбоя файл не
+        удаляется, его поправит ``reconcile_counters``.
+        """
+        names = list(ImageBlob.objects.filter(
+            refcount__lte=0).values_list('name', flat=True))
+        orphans = reclaimed = 0
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            referenced = set(Post.objects.filter(
+                image__in=batch).values_list('image', flat=True))
+            for name in batch:
+                if name in referenced:
+                    continue
+                if not self.storage.exists(name):
+                    if not self.dry_run:
+                        ImageBlob.objects.filter(name=name).delete()
+                elif self.is_stale(name):
+                    orphans += 1
+                    reclaimed += self.collect(name)
+        return orphans, reclaimed
+
+    def is_stale(self, name):
+        """Старые файлы: свежий может принадлежать ещё не записанному посту."""
+        modified = self.storage.get_modified_time(name).timestamp()
+        return modified < self.deadline
+
+    def collect(self, name):
+        """Удаляет файл и его миниатюры, возвращает освобождённые байты."""
+        sources = {
+            source.key: source for source in (
+                ImageFile(name, self.storage),
+                ImageFile(name, default_storage),
+            )
+        }
+        reclaimed = self.storage.size(name)
+        for source in sources.values():
+            for thumbnail in thumbnail_files(source):
+                if thumbnail.exists():
+                    reclaimed += thumbnail.storage.size(thumbnail.name)
+        if not self.dry_run:
+            for source in sources.values():
+                default.kvstore.delete(source)
+            self.storage.delete(name)
+            ImageBlob.objects.filter(name=name).delete()
+        return reclaimed
+
+
+def thumbnail_files(source):
+    """Миниатюры картинки, записанные в kvstore sorl-thumbnail."""
+    keys = default.kvstore._get(source.key, identity='thumbnails') or []
+    return [
+        thumbnail for thumbnail in map(default.kvstore._get, keys)
+        if thumbnail is not None
+    ]
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает все посты и комментарии автора в NDJSON или CSV. '
+        'Записи читаются из базы кусками и пишутся по мере чтения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Имя пользователя автора')
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default='ndjson',
+            help='Формат выгрузки')
+        parser.add_argument(
+            '--output', default='-',
+            help='Файл для выгрузки, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        author = User.objects.filter(username=options['username']).first()
+        if author is None:
+            raise CommandError(
+                f'Пользователь {options["username"]} не найден')
+        lines = export.export(author, options['format'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line.decode(), ending='')
+        else:
+            with open(options['output'], 'wb') as output:
+                output.writelines(lines)
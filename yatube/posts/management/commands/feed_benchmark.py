@@ -0,0 +1,94 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from posts.models import Follow, Post, User
+from posts.timeline import HybridFeedPaginator, feed, pulled_authors
+
+NEVER_PULL = 10 ** 9
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает push и pull для ленты подписок и оценивает порог '
+        'FEED_FANOUT_THRESHOLD. Все данные создаются в транзакции '
+        'и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--followers', type=int, nargs='+',
+            default=[10, 100, 1000, 5000, 20000],
+            help='Размеры аудитории автора для замера')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Сколько раз повторять каждый замер')
+        parser.add_argument(
+            '--reads-per-post', type=int, default=100,
+            help='Сколько раз ленту читают за время жизни одного поста')
+
+    def handle(self, *args, **options):
+        rows = []
+        try:
+            with transaction.atomic():
+                for followers in sorted(options['followers']):
+                    rows.append(
+                        self.measure(followers, options['repeat']))
+                raise Rollback
+        except Rollback:
+            pass
+        reads = options['reads_per_post']
+        self.stdout.write(
+            f'{"followers":>10} {"push, ms":>10} {"pull, ms":>10} '
+            f'{"pull x reads":>13}')
+        threshold = None
+        for followers, push, pull in rows:
+            self.stdout.write(
+                f'{followers:>10} {push:>10.2f} {pull:>10.2f} '
+                f'{pull * reads:>13.2f}')
+            if threshold is None and push > pull * reads:
+                threshold = followers
+        if threshold is None:
+            self.stdout.write('Push дешевле pull на всех размерах.')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Push дороже pull начиная примерно с {threshold} '
+                f'подписчиков: FEED_FANOUT_THRESHOLD = {threshold}'))
+
+    def measure(self, followers, repeat):
+        """Стоимость одного поста при push и штраф чтения при pull."""
+        author = User.objects.create(username=f'bench_author_{followers}')
+        User.objects.bulk_create(
+            User(username=f'bench_{followers}_{i}')
+            for i in range(followers))
+        readers = User.objects.filter(
+            username__startswith=f'bench_{followers}_')
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author, materialized=True)
+            for reader in readers)
+        reader = readers.first()
+
+        with override_settings(FEED_FANOUT_THRESHOLD=NEVER_PULL):
+            push = self.timed(repeat, lambda: Post.objects.create(
+                author=author, text='benchmark'))
+            pushed_read = self.timed(repeat, lambda: self.read(reader))
+        with override_settings(FEED_FANOUT_THRESHOLD=0):
+            pulled_read = self.timed(repeat, lambda: self.read(reader))
+        return followers, push, max(pulled_read - pushed_read, 0)
+
+    def read(self, user):
+        paginator = HybridFeedPaginator(
+            feed(user), 10, pulled=pulled_authors(user))
+        list(paginator.get_page())
+
+    def timed(self, repeat, func):
+        started = perf_counter()
+        for _ in range(repeat):
+            func()
+        return (perf_counter() - started) * 1000 / repeat
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Перестраивает материализованные ленты подписок с нуля. '
+        'С --incomplete только дозаполняет ленты подписок на авторов, '
+        'вернувшихся ниже FEED_FANOUT_THRESHOLD.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incomplete', action='store_true',
+            help='Дозаполнить только неполные ленты')
+
+    def handle(self, *args, **options):
+        if options['incomplete']:
+            with transaction.atomic():
+                total = timeline.materialize()
+            self.stdout.write(
+                self.style.SUCCESS(f'Дозаполнено подписок: {total}'))
+            return
+        with transaction.atomic():
+            total = timeline.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Записей в лентах: {total}'))
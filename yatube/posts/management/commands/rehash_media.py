@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from core.storage import HASHED_NAME
+from posts import counters, feed_cache, thumbnails
+from posts.models import ImageBlob, Post
+from posts.signals import purge_post_pages
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов в контентно-адресуемое хранилище: '
+        'переименовывает файлы по хешу, склеивает дубликаты и '
+        'перепривязывает посты. Повторный запуск продолжает с того '
+        'места, где остановился предыдущий.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать, ничего не меняя')
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        names = Post.objects.exclude(image='').exclude(
+            image__regex=HASHED_NAME.pattern
+        ).order_by('image').values_list('image', flat=True).distinct()
+        relinked = duplicates = missing = reclaimed = 0
+        for name in names.iterator():
+            if not storage.exists(name):
+                missing += 1
+                continue
+            size = storage.size(name)
+            with storage.open(name) as content:
+                new_name = storage.hashed_name(name, content)
+                duplicate = storage.exists(new_name)
+                if not options['dry_run']:
+                    storage.save(name, content)
+            relinked += 1
+            if duplicate:
+                duplicates += 1
+                reclaimed += size
+            if not options['dry_run']:
+                self.relink(storage, name, new_name)
+        prefix = 'Будет перенесено' if options['dry_run'] else 'Перенесено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} файлов: {relinked}, из них дубликатов: {duplicates}, '
+            f'освобождено байт: {reclaimed}, не найдено: {missing}'))
+
+    def relink(self, storage, name, new_name):
+        """Переводит посты на новое имя и удаляет старый файл."""
+        with transaction.atomic():
+            posts = list(
+                Post.objects.filter(image=name).select_related('author'))
+            Post.objects.filter(image=name).update(image=new_name)
+            ImageBlob.objects.filter(name=name).delete()
+            counters.change_image_refs(new_name, len(posts))
+        for post in posts:
+            feed_cache.bump_post_feeds(post.author_id, post.group_id)
+            purge_post_pages(post, post.group_id)
+        delete_thumbnails(ImageFile(name, storage))
+        thumbnails.schedule(ImageFile(new_name, storage))
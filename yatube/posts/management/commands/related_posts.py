@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts import related
+
+
+class Command(BaseCommand):
+    help = (
+        'Подбирает похожие посты по TF-IDF. Векторизует и считает только '
+        'посты без соседей, то есть новые и отредактированные, и '
+        'дополняет ими списки старых постов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=related.RELATED_COUNT,
+            help='Сколько похожих постов хранить для каждого')
+        parser.add_argument(
+            '--batch-size', type=int, default=related.BATCH_SIZE,
+            help='Сколько постов обсчитывать и записывать за раз')
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать весь корпус заново')
+
+    def handle(self, *args, **options):
+        stats = related.refresh(
+            options['count'], options['batch_size'], options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Векторизовано постов: {stats["vectorized"]}, '
+            f'обсчитано постов: {stats["posts"]}, '
+            f'обновлено списков: {stats["updated"]}'))
@@ -0,0 +1,92 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from sorl.thumbnail import default
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from posts.models import Post, User
+from posts.thumbnails import geometries, preloaded
+
+FEED_TEMPLATE = Template(
+    '{% load responsive_image %}{% for post in posts %}'
+    '{% responsive_image post.image %}{% endfor %}'
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает рендер ленты с поштучными и пакетными обращениями '
+        'к kvstore миниатюр. Все данные создаются в транзакции '
+        'и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--posts', type=int, default=10,
+            help='Сколько постов с картинками на странице')
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Сколько раз повторять каждый замер')
+
+    def handle(self, *args, **options):
+        keys = []
+        try:
+            with transaction.atomic():
+                posts = self.create_posts(options['posts'], keys)
+                rows = [
+                    (source, mode, *self.measure(
+                        posts, keys, source == 'db', mode == 'batched',
+                        options['repeat']))
+                    for source in ('db', 'cache')
+                    for mode in ('per-tag', 'batched')
+                ]
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            default.kvstore.cache.delete_many(keys)
+        self.stdout.write(
+            f'{"source":>8} {"lookups":>8} {"render, ms":>11} '
+            f'{"queries":>8}')
+        for source, mode, elapsed, queries in rows:
+            self.stdout.write(
+                f'{source:>8} {mode:>8} {elapsed:>11.2f} {queries:>8}')
+
+    def create_posts(self, count, keys):
+        """Посты с картинками, миниатюры которых уже есть в kvstore."""
+        author = User.objects.create(username='thumbnail_bench_author')
+        posts = Post.objects.bulk_create(
+            Post(author=author, text='benchmark',
+                 image=f'posts/thumbnail_bench_{i}.jpg')
+            for i in range(count))
+        for post in posts:
+            for geometry, options in geometries():
+                thumbnail = default.backend.thumbnail_file(
+                    post.image, geometry, options)
+                thumbnail.set_size([int(side) for side in geometry.split('x')])
+                default.kvstore.set(thumbnail)
+                keys.append(add_prefix(thumbnail.key))
+        return posts
+
+    def measure(self, posts, keys, cold, batched, repeat):
+        """Среднее время рендера и число запросов к БД на страницу."""
+        elapsed = 0
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(repeat):
+                if cold:
+                    default.kvstore.cache.delete_many(keys)
+                started = perf_counter()
+                if batched:
+                    with preloaded(posts):
+                        FEED_TEMPLATE.render(Context({'posts': posts}))
+                else:
+                    FEED_TEMPLATE.render(Context({'posts': posts}))
+                elapsed += perf_counter() - started
+        return elapsed * 1000 / repeat, len(queries) // repeat
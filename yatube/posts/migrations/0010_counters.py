@@ -0,0 +1,58 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    AuthorCounters = apps.get_model('posts', 'AuthorCounters')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    def count(model, field):
+        rows = model.objects.filter(
+            **{field: models.OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=models.Count('pk')).values('total')
+        return Coalesce(models.Subquery(rows), 0)
+
+    Post.objects.update(comments_count=count(Comment, 'post'))
+    AuthorCounters.objects.bulk_create(
+        AuthorCounters(
+            author_id=user.pk,
+            posts_count=user.actual_posts,
+            followers_count=user.actual_followers)
+        for user in User.objects.annotate(
+            actual_posts=count(Post, 'author'),
+            actual_followers=count(Follow, 'author')).iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0009_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество комментариев'),
+        ),
+        migrations.CreateModel(
+            name='AuthorCounters',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Количество постов')),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков')),
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:04
+
+import base64
+import io
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import migrations, models
+from django.db.models.fields.files import FieldFile
+from PIL import Image, ImageOps
+
+PLACEHOLDER_SIZE = (16, 6)
+
+
+def image_placeholder(image):
+    """Копия posts.uploads.image_placeholder на момент миграции."""
+    try:
+        with image.open() as content:
+            preview = Image.open(content)
+            preview.draft('RGB', PLACEHOLDER_SIZE)
+            preview = ImageOps.fit(
+                preview.convert('RGB'), PLACEHOLDER_SIZE, Image.BOX)
+    except (OSError, SuspiciousFileOperation, Image.DecompressionBombError):
+        return ''
+    buffer = io.BytesIO()
+    preview.save(buffer, 'PNG', optimize=True)
+    data = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{data}'
+
+
+def fill_placeholders(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    field = Post._meta.get_field('image')
+    names = Post.objects.exclude(image='').order_by().values_list(
+        'image', flat=True).distinct()
+    for name in names.iterator():
+        placeholder = image_placeholder(FieldFile(None, field, name))
+        if placeholder:
+            Post.objects.filter(image=name).update(
+                image_placeholder=placeholder)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Превью картинки'),
+        ),
+        migrations.RunPython(fill_placeholders, migrations.RunPython.noop),
+    ]
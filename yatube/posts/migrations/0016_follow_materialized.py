@@ -0,0 +1,36 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:24
+
+from django.db import migrations, models
+
+
+def mark_materialized(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    Timeline = apps.get_model('posts', 'Timeline')
+    for pk, user_id, author_id in Follow.objects.values_list(
+            'pk', 'user_id', 'author_id').iterator():
+        posts = Post.objects.filter(author_id=author_id).count()
+        rows = Timeline.objects.filter(
+            user_id=user_id, post__author_id=author_id).count()
+        if posts == rows:
+            Follow.objects.filter(pk=pk).update(materialized=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_related_posts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='follow',
+            name='materialized',
+            field=models.BooleanField(default=False, verbose_name='Посты разложены в ленту'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['author', 'materialized'], name='follow_materialized_idx'),
+        ),
+        migrations.RunPython(mark_materialized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_follow_materialized'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostVector',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='vector', serialize=False, to='posts.Post', verbose_name='Пост')),
+                ('terms', models.BinaryField(verbose_name='Id слов')),
+                ('weights', models.BinaryField(verbose_name='Веса слов')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=100, unique=True, verbose_name='Слово')),
+                ('df', models.IntegerField(default=0, verbose_name='Число постов со словом')),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from core.storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -39,9 +41,32 @@ class Post(models.Model):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         help_text='Загрузите картинку'
     )
+    image_placeholder = models.TextField(
+        'Превью картинки',
+        blank=True,
+        editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        'Количество комментариев',
+        default=0
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_feed_idx'),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_feed_idx'),
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='post_feed_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -68,6 +93,13 @@ class Comment(models.Model):
         'Дата публикации',
         auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=('post', 'created'),
+                name='comment_post_created_idx'),
+        ]
+
     def __str__(self):
         return self.text[:15]
 
@@ -85,6 +117,124 @@ class Follow(models.Model):
         related_name='following',
         verbose_name='Блогер'
     )
+    materialized = models.BooleanField(
+        'Посты разложены в ленту',
+        default=False
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'author'), name='unique_follow'),
+        ]
+        indexes = [
+            models.Index(
+                fields=('author', 'materialized'),
+                name='follow_materialized_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} Profile'
+
+
+class Timeline(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'post'), name='unique_timeline_post'),
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='timeline_user_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.post}'
+
+
+class AuthorCounters(models.Model):
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='counters',
+        verbose_name='Автор'
+    )
+    posts_count = models.PositiveIntegerField('Количество постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0
+    )
+
+    def __str__(self):
+        return f'{self.author} counters'
+
+
+class ImageBlob(models.Model):
+    name = models.CharField('Файл', max_length=100, unique=True)
+    refcount = models.IntegerField('Количество ссылок', default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+
+class RelatedPost(models.Model):
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='related_posts',
+        verbose_name='Пост'
+    )
+    related = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий пост'
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('post', 'related'), name='unique_related_post'),
+        ]
+
+    def __str__(self):
+        return f'{self.post} ~ {self.related}'
+
+
+class Term(models.Model):
+    word = models.CharField('Слово', max_length=100, unique=True)
+    df = models.IntegerField('Число постов со словом', default=0)
+
+    def __str__(self):
+        return f'{self.word} ({self.df})'
+
+
+class PostVector(models.Model):
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='vector',
+        verbose_name='Пост'
+    )
+    terms = models.BinaryField('Id слов')
+    weights = models.BinaryField('Веса слов')
+
+    def __str__(self):
+        return f'{self.post_id} vector'
@@ -0,0 +1,144 @@
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+NEXT = 'n'
+PREVIOUS = 'p'
+LAST_CURSOR = 'last'
+MAX_INT = 2 ** 63 - 1
+
+
+def encode_cursor(direction, post):
+    """Упаковывает (pub_date, id) поста в непрозрачный токен."""
+    payload = f'{direction}|{post.pub_date.isoformat()}|{post.pk}'
+    return urlsafe_base64_encode(force_bytes(payload))
+
+
+def decode_cursor(cursor):
+    """Распаковывает токен, для битого токена возвращает None."""
+    try:
+        payload = urlsafe_base64_decode(cursor).decode()
+        direction, pub_date, pk = payload.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or pub_date is None or (
+            abs(pk) > MAX_INT):
+        return None
+    return direction, pub_date, pk
+
+
+def keyset_slice(object_list, keys, descending, after, start, stop):
+    """Срез выборки, упорядоченной по ключу (дата, id), после ``after``."""
+    date_key, pk_key = keys
+    if descending:
+        object_list = object_list.order_by(f'-{date_key}', f'-{pk_key}')
+    else:
+        object_list = object_list.order_by(date_key, pk_key)
+    if after is not None:
+        lookup = 'lt' if descending else 'gt'
+        pub_date, pk = after
+        object_list = object_list.filter(
+            Q(**{f'{date_key}__{lookup}': pub_date})
+            | Q(**{date_key: pub_date, f'{pk_key}__{lookup}': pk}))
+    return list(object_list[start:stop])
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинатор ленты по (pub_date, id).
+
+    Страница выбирается одним запросом с LIMIT и без COUNT(*), а ссылки
+    на соседние страницы передаются непрозрачным ``?cursor=``.
+    Старые ссылки ``?page=N`` продолжают работать через OFFSET.
+    Поля ключа можно переопределить, например для ленты подписок,
+    которая сортируется по денормализованной копии даты в Timeline.
+    """
+
+    encode_cursor = staticmethod(encode_cursor)
+    decode_cursor = staticmethod(decode_cursor)
+
+    def __init__(self, object_list, per_page,
+                 keys=('pub_date', 'pk'), **kwargs):
+        self.keys = keys
+        super().__init__(object_list, per_page, **kwargs)
+
+    def __getstate__(self):
+        """Страница в кеше не должна тянуть за собой всю выборку."""
+        state = self.__dict__.copy()
+        state['object_list'] = None
+        return state
+
+    def _check_object_list_is_ordered(self):
+        """Порядок задаёт сам пагинатор, сортировка выборки не нужна."""
+
+    def get_page(self, cursor=None, number=None):
+        if cursor == LAST_CURSOR:
+            return self._last_page()
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is not None:
+            return self._cursor_page(cursor, *decoded)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            number = 1
+        return self._numbered_page(max(number, 1))
+
+    def _fetch(self, descending=True, after=None, offset=0):
+        """Следующие per_page + 1 объектов после ключа ``after``."""
+        return keyset_slice(
+            self.object_list, self.keys, descending, after,
+            offset, offset + self.per_page + 1)
+
+    def _numbered_page(self, number):
+        offset = (number - 1) * self.per_page
+        if offset + self.per_page + 1 > MAX_INT:
+            return self._last_page()
+        posts = self._fetch(offset=offset)
+        if not posts and number > 1:
+            return self._last_page()
+        has_next = len(posts) > self.per_page
+        return self._build_page(
+            posts[:self.per_page], number, has_next, number > 1)
+
+    def _cursor_page(self, cursor, direction, pub_date, pk):
+        if direction == NEXT:
+            posts = self._fetch(after=(pub_date, pk))
+            has_next = len(posts) > self.per_page
+            posts = posts[:self.per_page]
+            has_previous = True
+        else:
+            posts = self._fetch(False, after=(pub_date, pk))
+            has_previous = len(posts) > self.per_page
+            posts = posts[:self.per_page][::-1]
+            has_next = True
+        return self._build_page(posts, 1, has_next, has_previous, cursor)
+
+    def _last_page(self):
+        posts = self._fetch(False)
+        has_previous = len(posts) > self.per_page
+        posts = posts[:self.per_page][::-1]
+        return self._build_page(
+            posts, 1, False, has_previous, LAST_CURSOR)
+
+    def _build_page(self, posts, number, has_next, has_previous, cursor=''):
+        page = Page(posts, number, self)
+        page.cursor = cursor
+        page.next_cursor = (
+            self.encode_cursor(NEXT, posts[-1])
+            if has_next and posts else None)
+        page.previous_cursor = (
+            self.encode_cursor(PREVIOUS, posts[0])
+            if has_previous and posts else None)
+        page.is_first = not has_previous
+        return page
+
+
+def paginate(request, object_list, per_page,
+             paginator_class=CursorPaginator, **kwargs):
+    """Возвращает страницу ленты по параметрам ``cursor`` и ``page``."""
+    paginator = paginator_class(object_list, per_page, **kwargs)
+    return paginator.get_page(
+        request.GET.get('cursor'), request.GET.get('page'))
@@ -0,0 +1,263 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Q
+from scipy import sparse
+
+from core import page_cache
+
+from . import feed_cache
+from .models import Post, PostVector, RelatedPost, Term
+
+WORD = re.compile(r'[^\W\d_]{3,}')
+MAX_WORD_LENGTH = 100
+RELATED_COUNT = 5
+BATCH_SIZE = 200
+MAX_DF = 0.5
+CHUNK_SIZE = 500
+
+
+def tokenize(text):
+    return WORD.findall(text.casefold().replace('ё', 'е'))
+
+
+def term_weights(text):
+    """Слова текста с весом 1 + log tf; idf добавляется при подсчёте."""
+    counts = Counter(
+        word for word in tokenize(text) if len(word) <= MAX_WORD_LENGTH)
+    return {word: 1 + math.log(count) for word, count in counts.items()}
+
+
+def chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def change_df(term_ids, delta):
+    for chunk in chunks(term_ids, CHUNK_SIZE):
+        Term.objects.filter(pk__in=chunk).update(df=F('df') + delta)
+
+
+def add_terms(counts):
+    """Прибавляет ``{слово: число постов}`` к df словаря, отдаёт id слов."""
+    ids = {}
+    for chunk in chunks(counts, CHUNK_SIZE):
+        ids.update(Term.objects.filter(
+            word__in=chunk).values_list('word', 'pk'))
+    Term.objects.bulk_create(
+        [Term(word=word) for word in counts if word not in ids],
+        batch_size=CHUNK_SIZE,
+        ignore_conflicts=True,
+    )
+    for chunk in chunks(
+            [word for word in counts if word not in ids], CHUNK_SIZE):
+        ids.update(Term.objects.filter(
+            word__in=chunk).values_list('word', 'pk'))
+    by_delta = defaultdict(list)
+    for word, count in counts.items():
+        by_delta[count].append(ids[word])
+    for delta, term_ids in by_delta.items():
+        change_df(term_ids, delta)
+    return ids
+
+
+def vectorize_pending():
+    """Сохраняет векторы постов, у которых их ещё нет.
+
+    Это новые и отредактированные посты; тексты остальных не читаются.
+    Возвращает число новых векторов.
+    """
+    pending = list(Post.objects.filter(
+        vector__isnull=True).values_list('pk', flat=True))
+    for chunk in chunks(pending, CHUNK_SIZE):
+        weights = {
+            pk: term_weights(text)
+            for pk, text in Post.objects.filter(
+                pk__in=chunk).values_list('pk', 'text')
+        }
+        ids = add_terms(Counter(
+            word for words in weights.values() for word in words))
+        PostVector.objects.bulk_create(
+            [
+                PostVector(
+                    post_id=pk,
+                    terms=np.array(
+                        [ids[word] for word in words], np.int32).tobytes(),
+                    weights=np.array(
+                        list(words.values()), np.float32).tobytes(),
+                )
+                for pk, words in weights.items()
+            ],
+            batch_size=CHUNK_SIZE,
+            ignore_conflicts=True,
+        )
+    return len(pending)
+
+
+def forget(post_id):
+    """Убирает вектор поста из словаря и все пары похожих с его участием.
+
+    Посты, потерявшие соседа, досчитываются при следующем ``refresh()``.
+    """
+    vector = PostVector.objects.filter(post_id=post_id).first()
+    if vector is not None:
+        change_df(np.frombuffer(vector.terms, np.int32).tolist(), -1)
+        vector.delete()
+    RelatedPost.objects.filter(
+        Q(post_id=post_id) | Q(related_id=post_id)).delete()
+
+
+def load_idf(total):
+    """idf по id слова со сглаживанием; частые слова получают ноль.
+
+    Слова, которые встречаются больше чем в MAX_DF доле постов, почти
+    не отличают посты друг от друга, а их столбцы самые плотные.
+    """
+    rows = np.array(
+        list(Term.objects.values_list('pk', 'df').iterator()),
+        np.int64).reshape(-1, 2)
+    idf = np.zeros(rows[:, 0].max() + 1 if len(rows) else 0, np.float32)
+    term_ids, dfs = rows[:, 0], rows[:, 1]
+    weights = np.log((1 + total) / (1 + dfs)) + 1
+    weights[dfs > MAX_DF * total] = 0
+    idf[term_ids] = weights
+    return idf
+
+
+def load_matrix():
+    """Id постов и их TF-IDF матрица CSR с единичными строками.
+
+    Строки собираются из сохранённых векторов, без чтения текстов.
+    Разреженная матрица float32 занимает около 8 байт на пару
+    (пост, слово), поэтому корпус целиком помещается в память.
+    """
+    post_ids, terms, weights = [], [], []
+    vectors = PostVector.objects.order_by('post_id').values_list(
+        'post_id', 'terms', 'weights')
+    for post_id, row_terms, row_weights in vectors.iterator(CHUNK_SIZE):
+        post_ids.append(post_id)
+        terms.append(np.frombuffer(row_terms, np.int32))
+        weights.append(np.frombuffer(row_weights, np.float32))
+    idf = load_idf(len(post_ids))
+    indptr = np.zeros(len(post_ids) + 1, np.int64)
+    np.cumsum([len(row) for row in terms], out=indptr[1:])
+    indices = np.concatenate(terms) if terms else np.zeros(0, np.int32)
+    data = (
+        np.concatenate(weights) if weights else np.zeros(0, np.float32)
+    ) * idf[indices]
+    matrix = sparse.csr_matrix(
+        (data, indices, indptr), shape=(len(post_ids), len(idf)))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return np.array(post_ids, np.int64), sparse.diags(1 / norms) @ matrix
+
+
+def top(scores, columns, post_ids, count):
+    """Лучшие ``count`` соседей строки произведения как {id: косинус}."""
+    if len(scores) > count:
+        best = np.argpartition(-scores, count)[:count]
+        scores, columns = scores[best], columns[best]
+    return {
+        int(post_ids[column]): float(score)
+        for column, score in zip(columns, scores)
+    }
+
+
+def refresh(count=RELATED_COUNT, batch_size=BATCH_SIZE, full=False):
+    """Досчитывает похожие посты для постов, у которых меньше ``count``.
+
+    Векторы и df словаря хранятся между запусками, поэтому векторизуются
+    только новые и отредактированные посты. Сходства считаются для
+    неполных постов пачками по ``batch_size``: одна пачка - одно
+    произведение разреженных матриц Q * X^T. Так как косинус симметричен,
+    те же строки обновляют списки полных постов, к которым новый пост
+    оказался ближе их текущего k-го соседа. Пост, у которого меньше
+    ``count`` постов с общими словами, проверяется при каждом запуске.
+    ``full`` стирает векторы и соседей и пересчитывает всех.
+    """
+    if full:
+        RelatedPost.objects.all().delete()
+        PostVector.objects.all().delete()
+        Term.objects.all().delete()
+    vectorized = vectorize_pending()
+    post_ids, matrix = load_matrix()
+    neighbours = defaultdict(dict)
+    for post_id, related_id, score in RelatedPost.objects.values_list(
+            'post_id', 'related_id', 'score').iterator():
+        neighbours[post_id][related_id] = score
+    is_pending = np.array(
+        [len(neighbours.get(pk, ())) < count for pk in post_ids], bool)
+    pending_rows = np.flatnonzero(is_pending)
+    thresholds = np.array([
+        0 if pending else min(neighbours[pk].values())
+        for pk, pending in zip(post_ids, is_pending)
+    ], np.float32)
+    changed = set()
+    for batch in chunks(pending_rows, batch_size):
+        batch = np.array(batch, np.int64)
+        product = (matrix[batch] @ matrix.T).tocoo()
+        keep = (product.col != batch[product.row]) & (product.data > 0)
+        product = sparse.csr_matrix(
+            (product.data[keep], (product.row[keep], product.col[keep])),
+            shape=product.shape)
+        updated = set()
+        for row, matrix_row in enumerate(batch):
+            start, end = product.indptr[row], product.indptr[row + 1]
+            post_id = int(post_ids[matrix_row])
+            neighbours[post_id] = top(
+                product.data[start:end], product.indices[start:end],
+                post_ids, count)
+            updated.add(post_id)
+        entries = product.tocoo()
+        closer = ~is_pending[entries.col] & (
+            entries.data > thresholds[entries.col])
+        for row, column, score in zip(
+                entries.row[closer], entries.col[closer],
+                entries.data[closer]):
+            other = int(post_ids[column])
+            current = neighbours[other]
+            current[int(post_ids[batch[row]])] = float(score)
+            if len(current) > count:
+                del current[min(current, key=current.get)]
+            if len(current) >= count:
+                thresholds[column] = min(current.values())
+            updated.add(other)
+        save(updated, neighbours)
+        changed |= updated
+    authors = set()
+    for chunk in chunks(changed, CHUNK_SIZE):
+        authors.update(Post.objects.filter(pk__in=chunk).values_list(
+            'author_id', flat=True))
+    feed_cache.bump(*{feed_cache.profile_feed(pk) for pk in authors})
+    page_cache.purge(*(f'post:{pk}' for pk in changed))
+    return {
+        'vectorized': vectorized,
+        'posts': len(pending_rows),
+        'updated': len(changed),
+    }
+
+
+def save(post_ids, neighbours):
+    with transaction.atomic():
+        for chunk in chunks(post_ids, CHUNK_SIZE):
+            RelatedPost.objects.filter(post_id__in=chunk).delete()
+        RelatedPost.objects.bulk_create(
+            [
+                RelatedPost(post_id=post_id, related_id=related_id,
+                            score=score)
+                for post_id in post_ids
+                for related_id, score in neighbours[post_id].items()
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+
+
+def related_posts(post):
+    """Похожие посты одним запросом по индексу (post, related)."""
+    return [
+        row.related for row in RelatedPost.objects.filter(
+            post=post).select_related('related__author').order_by('-score')
+    ]
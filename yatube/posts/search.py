@@ -0,0 +1,126 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.encoding import force_bytes
+from django.utils.html import escape
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .paginator import MAX_INT, NEXT, PREVIOUS, CursorPaginator
+
+FTS_TABLE = 'posts_post_fts'
+WORD = re.compile(r'\w+')
+MARK_START, MARK_END = '\x02', '\x03'
+SNIPPET_TOKENS = 32
+
+
+def match_query(text):
+    """FTS5-запрос из строки пользователя, '' если искать нечего.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 в запросе
+    не работают и не ломают его. Последнее слово ищется по префиксу.
+    """
+    terms = [f'"{word}"' for word in WORD.findall(text.lower())]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def index_post(post):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text])
+
+
+def remove_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def matching_ids(match):
+    """Подзапрос id постов, подходящих под запрос, для ``pk__in``."""
+    return RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        [match])
+
+
+def highlight(snippet):
+    """Экранирует фрагмент и заменяет маркеры FTS5 на <mark>."""
+    return mark_safe(escape(snippet).replace(
+        MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search(match, forward=True, after=None, offset=0, limit=None):
+    """Посты по запросу в порядке bm25 с подсвеченным фрагментом.
+
+    Ключ порядка - (rank, rowid): rank у FTS5 тем меньше, чем
+    релевантнее пост. ``forward=False`` идёт от хвоста выдачи.
+    """
+    if not match:
+        return []
+    comparison, order = ('>', 'ASC') if forward else ('<', 'DESC')
+    where, params = '', [match]
+    if after is not None:
+        rank, pk = after
+        where = (
+            f'AND (rank {comparison} %s '
+            f'OR (rank = %s AND rowid {comparison} %s))')
+        params += [rank, rank, pk]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid, rank, snippet({FTS_TABLE}, 0, %s, %s, %s, %s) '
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s {where} '
+            f'ORDER BY rank {order}, rowid {order} LIMIT %s OFFSET %s',
+            [MARK_START, MARK_END, '…', SNIPPET_TOKENS,
+             *params, -1 if limit is None else limit, offset])
+        rows = cursor.fetchall()
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [pk for pk, _, _ in rows])
+    results = []
+    for pk, rank, snippet in rows:
+        if pk in posts:
+            post = posts[pk]
+            post.search_rank = rank
+            post.snippet = highlight(snippet)
+            results.append(post)
+    return results
+
+
+def encode_cursor(direction, post):
+    """Упаковывает (rank, id) найденного поста в непрозрачный токен."""
+    payload = f'{direction}|{post.search_rank!r}|{post.pk}'
+    return urlsafe_base64_encode(force_bytes(payload))
+
+
+def decode_cursor(cursor):
+    """Распаковывает токен, для битого токена возвращает None."""
+    try:
+        payload = urlsafe_base64_decode(cursor).decode()
+        direction, rank, pk = payload.split('|')
+        rank, pk = float(rank), int(pk)
+    except (TypeError, ValueError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or abs(pk) > MAX_INT:
+        return None
+    return direction, rank, pk
+
+
+class SearchPaginator(CursorPaginator):
+    """Keyset-пагинатор выдачи поиска по (rank, rowid).
+
+    Вместо выборки принимает FTS5-запрос из ``match_query()``;
+    страница - один запрос к индексу с LIMIT и один ``in_bulk``.
+    """
+
+    encode_cursor = staticmethod(encode_cursor)
+    decode_cursor = staticmethod(decode_cursor)
+
+    def _fetch(self, descending=True, after=None, offset=0):
+        return search(
+            self.object_list, descending, after, offset, self.per_page + 1)
@@ -0,0 +1,241 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from core import page_cache
+
+from . import (autocomplete, counters, feed_cache, related, search, timeline,
+               uploads)
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+    if created:
+        counters.change_author(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_author(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follower(sender, instance, created, **kwargs):
+    if created:
+        counters.change_author(instance.author_id, followers_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_lost_follower(sender, instance, **kwargs):
+    counters.change_author(instance.author_id, followers_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def push_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        timeline.push_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, update_fields, **kwargs):
+    if update_fields is None or 'text' in update_fields:
+        search.index_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def forget_related_posts(sender, instance, created, **kwargs):
+    old_text = getattr(instance, 'old_text', None)
+    if not created and old_text is not None and old_text != instance.text:
+        related.forget(instance.pk)
+
+
+@receiver(pre_delete, sender=Post)
+def forget_deleted_post_vector(sender, instance, **kwargs):
+    related.forget(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, **kwargs):
+    instance.old_group_id, instance.old_image = None, ''
+    instance.old_text = None
+    if instance.pk:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image', 'text').first()
+        if old is not None:
+            (instance.old_group_id, instance.old_image,
+             instance.old_text) = old
+
+
+@receiver(pre_save, sender=Post)
+def make_image_placeholder(sender, instance, **kwargs):
+    if instance.image.name != instance.old_image:
+        instance.image_placeholder = uploads.image_placeholder(
+            instance.image)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, **kwargs):
+    old_image = getattr(instance, 'old_image', '')
+    if instance.image.name != old_image:
+        counters.change_image_refs(instance.image.name, 1)
+        counters.change_image_refs(old_image, -1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_image_ref(sender, instance, **kwargs):
+    counters.change_image_refs(instance.image.name, -1)
+
+
+def after_commit(func, *args):
+    """Сбрасывает кеши сейчас и ещё раз после коммита транзакции.
+
+    Запрос другого воркера между сбросом и коммитом видит новую версию
+    ленты со старыми строками и может закешировать страницу под ней.
+    Повторный сброс после коммита делает такую страницу недоступной.
+    """
+    func(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: func(*args))
+
+
+def purge_post_pages(post, *group_ids):
+    slugs = Group.objects.filter(
+        pk__in=[group_id for group_id in group_ids if group_id]
+    ).values_list('slug', flat=True)
+    after_commit(
+        page_cache.purge,
+        'feed:index',
+        f'post:{post.pk}',
+        f'author:{post.author.username}',
+        *(f'group:{slug}' for slug in slugs))
+
+
+@receiver(post_save, sender=Post)
+def invalidate_saved_post(sender, instance, **kwargs):
+    old_group_id = getattr(instance, 'old_group_id', None)
+    after_commit(
+        feed_cache.bump_post_feeds,
+        instance.author_id, instance.group_id, old_group_id)
+    purge_post_pages(instance, instance.group_id, old_group_id)
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post(sender, instance, **kwargs):
+    after_commit(
+        feed_cache.bump_post_feeds, instance.author_id, instance.group_id)
+    purge_post_pages(instance, instance.group_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_post(sender, instance, **kwargs):
+    post = Post.objects.filter(
+        pk=instance.post_id).values_list('author_id', 'group_id').first()
+    if post is not None:
+        after_commit(feed_cache.bump_post_feeds, *post)
+    after_commit(page_cache.purge, f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_followed_author(sender, instance, **kwargs):
+    after_commit(
+        feed_cache.bump, feed_cache.profile_feed(instance.author_id))
+    after_commit(page_cache.purge, f'author:{instance.author.username}')
+
+
+@receiver(pre_save, sender=Group)
+def remember_old_slug(sender, instance, **kwargs):
+    instance.old_slug = instance.pk and Group.objects.filter(
+        pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, instance, **kwargs):
+    after_commit(feed_cache.bump, feed_cache.GLOBAL_FEED)
+    after_commit(
+        page_cache.purge,
+        *{f'group:{slug}' for slug in (
+            instance.slug, getattr(instance, 'old_slug', None)) if slug})
+
+
+def is_login(update_fields):
+    return update_fields is not None and set(update_fields) == {'last_login'}
+
+
+@receiver(pre_save, sender=User)
+def remember_old_username(sender, instance, update_fields=None, **kwargs):
+    instance.old_username = None
+    if instance.pk and not is_login(update_fields):
+        instance.old_username = User.objects.filter(
+            pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, update_fields=None, **kwargs):
+    if is_login(update_fields):
+        return
+    after_commit(feed_cache.bump, feed_cache.GLOBAL_FEED)
+    after_commit(
+        page_cache.purge,
+        *{f'author:{username}' for username in (
+            instance.username, getattr(instance, 'old_username', None))
+          if username})
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    after_commit(feed_cache.bump, feed_cache.GLOBAL_FEED)
+    after_commit(page_cache.purge, f'author:{instance.username}')
+
+
+@receiver(post_save, sender=User)
+def autocomplete_user(sender, instance, update_fields, **kwargs):
+    if update_fields is None or set(update_fields) & set(
+            autocomplete.USER_FIELDS):
+        autocomplete.update(*autocomplete.user_entry(instance))
+
+
+@receiver(post_delete, sender=User)
+def autocomplete_deleted_user(sender, instance, **kwargs):
+    autocomplete.update(('user', instance.pk))
+
+
+@receiver(post_save, sender=Group)
+def autocomplete_group(sender, instance, **kwargs):
+    autocomplete.update(*autocomplete.group_entry(instance))
+
+
+@receiver(post_delete, sender=Group)
+def autocomplete_deleted_group(sender, instance, **kwargs):
+    autocomplete.update(('group', instance.pk))
@@ -0,0 +1,68 @@
+from django import template
+from django.conf import settings
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from posts.thumbnails import geometries, signed_url
+
+register = template.Library()
+
+SIZES = '(max-width: 960px) 100vw, 960px'
+DEFAULT_WIDTH = 960
+
+
+@register.inclusion_tag('posts/includes/responsive_image.html')
+def responsive_image(image, placeholder=''):
+    """<picture> со srcset из вариантов картинки поста.
+
+    Последний формат THUMBNAIL_FORMATS (JPEG) идёт в запасной <img>,
+    остальные становятся <source>. Готовые варианты отдаются из медиа
+    с размерами из kvstore. Ещё не нарезанные ссылаются на подписанный
+    адрес ``views.thumbnail`` с размерами из геометрии, поэтому рендер
+    не ждёт нарезки и не показывает заглушку. Пока картинка грузится,
+    под ней виден ``placeholder`` - размытое превью поста.
+    """
+    if not image:
+        return {'image': image}
+    variants = {}
+    for geometry, options in geometries():
+        thumbnail = default.backend.get_thumbnail(image, geometry, **options)
+        if thumbnail is not None:
+            variant = {
+                'url': thumbnail.url,
+                'width': thumbnail.width,
+                'height': thumbnail.height,
+            }
+        else:
+            width, height = map(int, geometry.split('x'))
+            variant = {
+                'url': signed_url(image, geometry, options),
+                'width': width,
+                'height': height,
+            }
+        image_format = options.get('format', sorl_settings.THUMBNAIL_FORMAT)
+        variants.setdefault(image_format, []).append(variant)
+    *formats, fallback_format = settings.THUMBNAIL_FORMATS
+    if fallback_format not in variants:
+        return {'image': image, 'placeholder': placeholder}
+    fallback = variants[fallback_format]
+    main = min(fallback, key=lambda variant: abs(
+        variant['width'] - DEFAULT_WIDTH))
+    return {
+        'image': image,
+        'placeholder': placeholder,
+        'sizes': SIZES,
+        'sources': [
+            {
+                'type': f'image/{image_format.lower()}',
+                'srcset': srcset(variants[image_format]),
+            }
+            for image_format in formats if image_format in variants
+        ],
+        'fallback': dict(main, srcset=srcset(fallback)),
+    }
+
+
+def srcset(variants):
+    return ', '.join(
+        f'{variant["url"]} {variant["width"]}w' for variant in variants)
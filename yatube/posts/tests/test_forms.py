@@ -1,14 +1,32 @@
+import base64
+import io
+import os
 import shutil
 import tempfile
+import time
+from io import StringIO
+from unittest import mock
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template.defaultfilters import filesizeformat
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.images import ImageFile
 
-from ..models import Comment, Group, Post, User
+from core.storage import HASHED_NAME
+
+from .. import uploads
+from ..models import Comment, Group, ImageBlob, Post, User
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+ORIENTATION = 0x0112
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -140,3 +158,231 @@ class PostCreateFormTests(TestCase):
                 text='new comment of authorized user'
             ).exists()
         )
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    POST_IMAGE_MAX_DIMENSIONS=(100, 100),
+    POST_IMAGE_MAX_BYTES=4096,
+)
+class ImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def image_file(name, image_format, image, **save_options):
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **save_options)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def upload(self, image):
+        self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': image})
+        return Post.objects.get(text='Пост с картинкой').image
+
+    def test_photo_is_rotated_shrunk_and_stripped(self):
+        """Фото поворачивается по EXIF, уменьшается и теряет метаданные"""
+        exif = Image.Exif()
+        exif[ORIENTATION] = 6
+        photo = Image.effect_noise((400, 200), 60).convert('RGB')
+        stored = self.upload(self.image_file(
+            'photo.jpeg', 'JPEG', photo, exif=exif, quality=100))
+        self.assertTrue(stored.name.endswith('.jpg'))
+        self.assertLessEqual(stored.size, 4096)
+        with Image.open(stored) as image:
+            self.assertEqual(image.size, (50, 100))
+            self.assertNotIn(ORIENTATION, image.getexif())
+
+    def test_transparent_image_kept_as_png(self):
+        """Картинка с прозрачностью перекодируется в PNG"""
+        stored = self.upload(self.image_file(
+            'logo.png', 'PNG', Image.new('RGBA', (300, 300))))
+        self.assertTrue(stored.name.endswith('.png'))
+        with Image.open(stored) as image:
+            self.assertEqual(image.mode, 'RGBA')
+            self.assertEqual(image.size, (100, 100))
+
+    def test_placeholder_computed_on_upload(self):
+        """При загрузке у поста сохраняется крошечное превью картинки"""
+        self.upload(self.image_file(
+            'red.png', 'PNG', Image.new('RGB', (300, 100), 'red')))
+        post = Post.objects.get(text='Пост с картинкой')
+        prefix = 'data:image/png;base64,'
+        self.assertTrue(post.image_placeholder.startswith(prefix))
+        self.assertLess(len(post.image_placeholder), 600)
+        data = base64.b64decode(post.image_placeholder[len(prefix):])
+        with Image.open(io.BytesIO(data)) as preview:
+            self.assertEqual(preview.size, uploads.PLACEHOLDER_SIZE)
+            red, green, blue = preview.getpixel((0, 0))
+        self.assertGreater(red, 240)
+        self.assertLess(green + blue, 20)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, post.image_placeholder)
+        with mock.patch.object(uploads, 'image_placeholder') as placeholder:
+            post.text = 'Новый текст'
+            post.save()
+        placeholder.assert_not_called()
+
+    @override_settings(POST_IMAGE_MAX_UPLOAD_BYTES=1024)
+    def test_too_big_upload_rejected(self):
+        """Слишком большой файл отклоняется формой"""
+        upload = self.image_file(
+            'noise.png', 'PNG', Image.effect_noise((100, 100), 60))
+        response = self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': upload})
+        self.assertFormError(
+            response, 'form', 'image',
+            f'Файл слишком большой: не больше {filesizeformat(1024)}.')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Meme Poster')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        buffer = io.BytesIO()
+        Image.new('RGB', (20, 10), 'red').save(buffer, 'PNG')
+        self.content = buffer.getvalue()
+
+    def test_same_upload_shares_blob(self):
+        """Повторная загрузка тех же байтов использует один файл"""
+        for i in range(2):
+            self.client.post(reverse('posts:post_create'), data={
+                'text': f'Мем {i}',
+                'image': SimpleUploadedFile(f'meme_{i}.png', self.content),
+            })
+        first, second = Post.objects.filter(text__startswith='Мем')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, HASHED_NAME)
+        blob = ImageBlob.objects.get(name=first.image.name)
+        self.assertEqual(blob.refcount, 2)
+        second.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+
+    def test_rehash_media_command(self):
+        """rehash_media переименовывает старые файлы и склеивает дубликаты"""
+        legacy = FileSystemStorage(location=TEMP_MEDIA_ROOT)
+        posts = []
+        for name in ('posts/first.png', 'posts/second.png'):
+            legacy.save(name, ContentFile(self.content))
+            posts.append(Post.objects.create(
+                author=self.user, text='legacy', image=name))
+        out = StringIO()
+        call_command('rehash_media', stdout=out)
+        self.assertIn('дубликатов: 1', out.getvalue())
+        for post in posts:
+            post.refresh_from_db()
+            self.assertRegex(post.image.name, HASHED_NAME)
+        self.assertEqual(posts[0].image.name, posts[1].image.name)
+        self.assertFalse(legacy.exists('posts/first.png'))
+        self.assertFalse(legacy.exists('posts/second.png'))
+        self.assertEqual(
+            ImageBlob.objects.get(name=posts[0].image.name).refcount, 2)
+        self.assertFalse(
+            ImageBlob.objects.filter(name='posts/first.png').exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CollectMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Collector')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        self.storage = Post._meta.get_field('image').storage
+        self.kept = self.save(b'kept', age=7200)
+        Post.objects.create(author=self.user, text='kept', image=self.kept)
+        buffer = io.BytesIO()
+        Image.new('RGB', (20, 10), 'blue').save(buffer, 'PNG')
+        self.orphans = [self.save(buffer.getvalue(), age=7200)] + [
+            self.save(f'orphan_{i}'.encode(), age=7200) for i in range(2)]
+        self.fresh = self.save(b'fresh', age=0)
+
+    def save(self, content, age):
+        name = self.storage.save('posts/x.png', ContentFile(content))
+        stamp = time.time() - age
+        os.utime(self.storage.path(name), (stamp, stamp))
+        return name
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_media', *args, stdout=out)
+        return out.getvalue()
+
+    def test_orphans_deleted(self):
+        """Удаляются только старые файлы без постов"""
+        thumbnail = ThumbnailBackend().get_thumbnail(
+            ImageFile(self.orphans[0], self.storage), '10x10')
+        self.assertTrue(thumbnail.exists())
+        output = self.collect()
+        self.assertIn('сирот: 3', output)
+        for name in self.orphans:
+            self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(self.kept))
+        self.assertTrue(self.storage.exists(self.fresh))
+        self.assertFalse(thumbnail.exists())
+
+    def test_released_blobs_deleted_without_scan(self):
+        """--released удаляет файлы, на которые больше нет ссылок"""
+        released = self.save(b'released', age=7200)
+        Post.objects.create(
+            author=self.user, text='released', image=released).delete()
+        drifted = self.save(b'drifted', age=7200)
+        Post.objects.create(author=self.user, text='drifted', image=drifted)
+        ImageBlob.objects.filter(name=drifted).update(refcount=0)
+        self.assertEqual(ImageBlob.objects.get(name=released).refcount, 0)
+        output = self.collect('--released')
+        self.assertIn('Удалено сирот: 1', output)
+        self.assertFalse(self.storage.exists(released))
+        self.assertFalse(ImageBlob.objects.filter(name=released).exists())
+        self.assertTrue(self.storage.exists(drifted))
+        for name in self.orphans:
+            self.assertTrue(self.storage.exists(name))
+
+    def test_dry_run_keeps_files(self):
+        """--dry-run только считает"""
+        output = self.collect('--dry-run')
+        self.assertIn('Будет удалено сирот: 3', output)
+        for name in self.orphans:
+            self.assertTrue(self.storage.exists(name))
+
+    def test_resume_after_limit(self):
+        """Обход порциями продолжается с сохранённой позиции"""
+        output = self.collect('--limit', '2', '--batch-size', '1')
+        self.assertIn('Просмотрено файлов: 2', output)
+        self.assertIn('Обход остановлен', output)
+        output = self.collect()
+        self.assertIn('Просмотрено файлов: 3', output)
+        for name in self.orphans:
+            self.assertFalse(self.storage.exists(name))
+        self.assertIn('Просмотрено файлов: 2', self.collect())
@@ -1,6 +1,11 @@
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-from ..models import Group, Post, User
+from ..models import Comment, Follow, Group, Post, User
+from ..paginator import NEXT, encode_cursor
 
 
 class PostModelTest(TestCase):
@@ -54,3 +59,63 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class FeedQueryPlanTest(TestCase):
+    """Запросы лент не должны читать таблицы posts целиком."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='planner')
+        cls.author = User.objects.create_user(username='planned')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='plan-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.post = Post.objects.create(
+            author=cls.author,
+            group=cls.group,
+            text='Тестовый пост',
+        )
+        Comment.objects.create(
+            post=cls.post, author=cls.user, text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def full_scans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        scans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    if (detail.startswith(('SCAN posts_', 'SCAN TABLE posts_'))
+                            and 'INDEX' not in detail):
+                        scans.append(f'{detail}: {sql}')
+        return scans
+
+    def test_feed_queries_use_indexes(self):
+        """Ленты и страница поста обходятся без полного сканирования."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse(
+                'posts:profile', kwargs={'username': self.author.username}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('posts:follow_index'),
+        )
+        cursor = encode_cursor(NEXT, self.post)
+        for url in urls:
+            for page in (url, f'{url}?cursor={cursor}'):
+                with self.subTest(url=page):
+                    self.assertEqual(self.full_scans(page), [])
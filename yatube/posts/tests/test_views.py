@@ -1,15 +1,32 @@
+import csv
 import shutil
 import tempfile
+import warnings
 from datetime import date
+from io import StringIO
+from unittest import mock
 
+import orjson
 from django import forms
 from django.conf import settings
-from django.core.cache import cache
+from django.contrib.auth.hashers import make_password
+from django.core.cache import CacheKeyWarning, cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import urlencode
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
 
-from ..models import Follow, Group, Post, User
+from .. import (api, autocomplete, counters, export, related,
+                thumbnails, timeline)
+from ..feed_cache import INDEX_FEED, feed_version
+from ..models import (AuthorCounters, Comment, Follow, Group, Post,
+                      RelatedPost, Term, Timeline, User)
+from .utils import QueryBudgetMixin
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -231,6 +248,78 @@ class PaginatorViewsTest(TestCase):
             self.assertEqual(
                 len(response.context['page_obj']), AMOUNT_POSTS_SECOND_PAGE)
 
+    def test_cursor_pages_cover_all_records(self):
+        """Курсоры next/previous обходят ленту без пропусков и повторов"""
+        for template in self.templates_pages_names:
+            with self.subTest(template=template):
+                first_page = self.client.get(template).context['page_obj']
+                self.assertIsNone(first_page.previous_cursor)
+                second_page = self.client.get(
+                    template + '?cursor=' + first_page.next_cursor
+                ).context['page_obj']
+                self.assertIsNone(second_page.next_cursor)
+                seen = [post.pk for post in first_page]
+                seen += [post.pk for post in second_page]
+                self.assertEqual(len(set(seen)), self.TEST_AMOUNT_POSTS)
+                back_page = self.client.get(
+                    template + '?cursor=' + second_page.previous_cursor
+                ).context['page_obj']
+                self.assertEqual(
+                    [post.pk for post in back_page],
+                    [post.pk for post in first_page])
+
+    def test_follow_cursor_with_several_followers(self):
+        """Курсор ленты подписок видит только строки Timeline читателя"""
+        readers = [
+            User.objects.create(username=f'cursor_reader_{i}')
+            for i in range(2)
+        ]
+        for reader in readers:
+            Follow.objects.create(user=reader, author=self.user)
+        self.client.force_login(readers[0])
+        url = reverse('posts:follow_index')
+        first_page = self.client.get(url).context['page_obj']
+        second_page = self.client.get(
+            url + '?cursor=' + first_page.next_cursor).context['page_obj']
+        back_page = self.client.get(
+            url + '?cursor=' + second_page.previous_cursor
+        ).context['page_obj']
+        seen = [post.pk for post in first_page]
+        seen += [post.pk for post in second_page]
+        self.assertEqual(len(seen), self.TEST_AMOUNT_POSTS)
+        self.assertEqual(len(set(seen)), self.TEST_AMOUNT_POSTS)
+        self.assertIsNone(second_page.next_cursor)
+        self.assertEqual(list(back_page), list(first_page))
+
+    def test_last_cursor_and_bad_cursor(self):
+        """Курсор last ведёт на конец ленты, битый курсор - на начало"""
+        response = self.client.get(reverse('posts:index') + '?cursor=last')
+        self.assertEqual(
+            len(response.context['page_obj']), self.TEST_POST_PER_PAGE)
+        self.assertIsNone(response.context['page_obj'].next_cursor)
+        response = self.client.get(reverse('posts:index') + '?cursor=xyz')
+        self.assertIsNone(response.context['page_obj'].previous_cursor)
+
+    def test_huge_page_number(self):
+        """Номер страницы больше 64 бит ведёт на последнюю страницу"""
+        for template in self.templates_pages_names:
+            with self.subTest(template=template):
+                response = self.client.get(
+                    template + '?page=99999999999999999999')
+                page_obj = response.context['page_obj']
+                self.assertEqual(page_obj.cursor, 'last')
+                self.assertIsNone(page_obj.next_cursor)
+
+    def test_paginator_does_not_count(self):
+        """Пагинатор ленты не выполняет COUNT(*)"""
+        page_obj = self.client.get(
+            reverse('posts:index')).context['page_obj']
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(
+                reverse('posts:index') + '?cursor=' + page_obj.next_cursor)
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries.captured_queries))
+
 
 class CahePageTest(TestCase):
     @classmethod
@@ -259,17 +348,9 @@ class CahePageTest(TestCase):
 
     def test_cache_index_page(self):
         """Страница index_page сохраняет в cache список постов."""
-        form_data = {
-            'text': 'Текст новго поста',
-            'group': self.group.id,
-        }
         response = self.authorized_client.get(reverse('posts:index'))
         content_before = response.content
-        self.authorized_client.post(
-            reverse('posts:post_create'),
-            data=form_data,
-            follow=True
-        )
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
         response = self.authorized_client.get(reverse('posts:index'))
         content_after = response.content
         self.assertTrue(content_before == content_after)
@@ -278,6 +359,42 @@ class CahePageTest(TestCase):
         content_after = response.content
         self.assertTrue(content_before != content_after)
 
+    def test_new_post_invalidates_feed_caches(self):
+        """Новый пост сразу виден в закешированных лентах."""
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse(
+                'posts:profile', kwargs={'username': self.user.username}),
+        )
+        for page in pages:
+            self.authorized_client.get(page)
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Текст новго поста', 'group': self.group.id},
+            follow=True
+        )
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.authorized_client.get(page)
+                self.assertContains(response, 'Текст новго поста')
+
+    def test_feeds_invalidated_again_after_commit(self):
+        """После коммита версии лент сбрасываются повторно."""
+        callbacks = []
+        with mock.patch.object(transaction, 'on_commit', callbacks.append):
+            Post.objects.create(author=self.user, text='Новый пост')
+        version = feed_version(INDEX_FEED)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(feed_version(INDEX_FEED), version)
+
+    def test_login_does_not_invalidate_feed_cache(self):
+        """Вход пользователя не сбрасывает версии лент."""
+        version = feed_version(INDEX_FEED)
+        Client().force_login(self.user)
+        self.assertEqual(feed_version(INDEX_FEED), version)
+
 
 class FollowTest(TestCase):
     @classmethod
@@ -367,3 +484,915 @@ class FollowTest(TestCase):
         response_follower_other = self.follower_other.get(
             reverse('posts:follow_index',))
         self.assertEqual(len(response_follower_other.context["page_obj"]), 0)
+
+    def test_unfollow_prunes_timeline(self):
+        """После отписки посты блогера пропадают из ленты подписок"""
+        self.follower.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.main_author.username})
+        )
+        response = self.follower.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+        self.assertFalse(
+            Timeline.objects.filter(user=self.main_follower).exists())
+
+    def test_follow_backfills_timeline(self):
+        """После подписки в ленту попадают старые посты блогера"""
+        self.follower_other.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': self.main_author.username})
+        )
+        response = self.follower_other.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            len(response.context['page_obj']), self.TEST_AMOUNT_POSTS)
+
+    def test_rebuild_timelines_command(self):
+        """Команда rebuild_timelines восстанавливает ленты подписок"""
+        Timeline.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(
+            Timeline.objects.filter(user=self.main_follower).count(),
+            self.TEST_AMOUNT_POSTS)
+
+    @override_settings(FEED_FANOUT_THRESHOLD=0)
+    def test_pulled_author_posts_merged_on_read(self):
+        """Посты популярного автора подмешиваются в ленту при чтении"""
+        self.bloger.post(
+            reverse('posts:post_create'),
+            data={'text': 'Текст новго поста'},
+            follow=True
+        )
+        self.assertEqual(
+            Timeline.objects.filter(user=self.main_follower).count(),
+            self.TEST_AMOUNT_POSTS)
+        response = self.follower.get(reverse('posts:follow_index'))
+        posts = list(response.context['page_obj'])
+        self.assertEqual(len(posts), self.TEST_AMOUNT_POSTS + 1)
+        self.assertEqual(len({post.pk for post in posts}), len(posts))
+        self.assertEqual(posts[0].text, 'Текст новго поста')
+
+    def test_delete_author_with_followers(self):
+        """Автора с подписчиками можно удалить вместе с подписками"""
+        AuthorCounters.objects.filter(author=self.main_author).delete()
+        author = User.objects.get(pk=self.main_author.pk)
+        author.delete()
+        self.assertFalse(AuthorCounters.objects.filter(
+            author_id=self.main_author.pk).exists())
+        self.assertFalse(Follow.objects.filter(
+            author_id=self.main_author.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA foreign_key_check')
+            self.assertEqual(cursor.fetchall(), [])
+
+    def test_author_crossing_threshold_keeps_posts(self):
+        """Посты, написанные выше порога, остаются в ленте после спуска"""
+        with self.settings(FEED_FANOUT_THRESHOLD=1):
+            Follow.objects.create(
+                user=self.second_follower, author=self.main_author)
+            Post.objects.create(author=self.main_author, text='Выше порога')
+            pulled = User.objects.create(username='Pulled Follower')
+            Follow.objects.create(user=pulled, author=self.main_author)
+            Follow.objects.filter(user=self.second_follower).delete()
+            self.follower.get(reverse(
+                'posts:profile_unfollow',
+                kwargs={'username': self.main_author.username})
+            )
+            self.assertFalse(Timeline.objects.filter(user=pulled).exists())
+            client = Client()
+            client.force_login(pulled)
+            response = client.get(reverse('posts:follow_index'))
+            self.assertEqual(
+                len(response.context['page_obj']),
+                self.TEST_AMOUNT_POSTS + 1)
+            call_command(
+                'rebuild_timelines', '--incomplete', stdout=StringIO())
+            self.assertEqual(
+                Timeline.objects.filter(user=pulled).count(),
+                self.TEST_AMOUNT_POSTS + 1)
+            self.assertEqual(timeline.pulled_authors(pulled), [])
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='Counted Author')
+        cls.reader = User.objects.create(username='Counted Reader')
+        cls.post = Post.objects.create(
+            author=cls.author,
+            text='test_text_post',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_counters_follow_views(self):
+        """Счётчики обновляются при постах, комментариях и подписках"""
+        self.reader_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.id}),
+            data={'text': 'Комментарий'}
+        )
+        self.reader_client.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': self.author.username})
+        )
+        self.author_client.post(
+            reverse('posts:post_create'), data={'text': 'Второй пост'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        response = self.reader_client.get(reverse(
+            'posts:profile', kwargs={'username': self.author.username}))
+        self.assertEqual(response.context['post_count'], 2)
+        self.assertEqual(response.context['followers_count'], 1)
+
+        self.reader_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username})
+        )
+        Post.objects.get(text='Второй пост').delete()
+        counters = AuthorCounters.objects.get(author=self.author)
+        self.assertEqual(counters.posts_count, 1)
+        self.assertEqual(counters.followers_count, 0)
+
+    def test_reconcile_counters_command(self):
+        """Команда reconcile_counters исправляет расхождения"""
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий')
+        Post.objects.filter(pk=self.post.pk).update(comments_count=7)
+        AuthorCounters.objects.update_or_create(
+            author=self.author,
+            defaults={'posts_count': 9, 'followers_count': 3})
+        call_command('reconcile_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        counters = AuthorCounters.objects.get(author=self.author)
+        self.assertEqual(counters.posts_count, 1)
+        self.assertEqual(counters.followers_count, 0)
+        self.assertTrue(
+            AuthorCounters.objects.filter(author=self.reader).exists())
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='Budget Reader')
+        cls.groups = [
+            Group.objects.create(
+                title=f'test_group_{i}',
+                slug=f'budget_slug_{i}',
+                description='test_description',
+            ) for i in range(3)
+        ]
+        cls.authors = [
+            User.objects.create(
+                username=f'Budget Author {i}',
+                first_name='Test',
+                last_name=f'User {i}',
+            ) for i in range(3)
+        ]
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        for i in range(12):
+            cls.post = Post.objects.create(
+                author=cls.authors[i % 3],
+                group=cls.groups[i % 3],
+                text='test_text_post №' + str(i),
+            )
+        for author in cls.authors:
+            Comment.objects.create(
+                post=cls.post, author=author, text='Комментарий')
+        counters.reconcile()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def test_pages_fit_query_budget(self):
+        """Страницы укладываются в бюджет запросов к БД"""
+        pages = (
+            ('posts:index', None),
+            ('posts:group_list', {'slug': self.groups[0].slug}),
+            ('posts:profile', {'username': self.authors[0].username}),
+            ('posts:post_detail', {'post_id': self.post.id}),
+            ('posts:follow_index', None),
+        )
+        for url_name, kwargs in pages:
+            with self.subTest(url_name=url_name):
+                self.assertQueryBudget(self.client, url_name, kwargs)
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='Cached Author')
+        cls.group = Group.objects.create(
+            title='test_group',
+            slug='cached_slug',
+            description='test_description',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='test_text_post',
+            group=cls.group,
+        )
+        cls.other_post = Post.objects.create(
+            author=User.objects.create(username='Other Author'),
+            text='other_text_post',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_cached(self):
+        """Страницы для анонимов отдаются из кеша и помечены ключами"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertIn(f'post:{self.post.pk}', response['Surrogate-Key'])
+        self.assertIn('group:cached_slug', response['Surrogate-Key'])
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+
+    def test_authorized_pages_are_not_cached(self):
+        """Авторизованный пользователь не получает общий кеш"""
+        client = Client()
+        client.force_login(self.user)
+        client.get(reverse('posts:index'))
+        response = client.get(reverse('posts:index'))
+        self.assertNotIn('X-Page-Cache', response)
+
+    def test_purge_only_affected_pages(self):
+        """Правка поста сбрасывает только страницы с этим постом"""
+        post_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.id})
+        other_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.other_post.id})
+        self.client.get(post_url)
+        self.client.get(other_url)
+        self.post.text = 'edited_text_post'
+        self.post.save()
+        response = self.client.get(post_url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'edited_text_post')
+        response = self.client.get(other_url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+
+    def test_rename_purges_old_pages(self):
+        """Смена slug группы и имени автора сбрасывает старые страницы"""
+        group = Group.objects.create(title='Переименуемая', slug='old_slug')
+        author = User.objects.create(username='Old Name')
+        group_url = reverse('posts:group_list', kwargs={'slug': 'old_slug'})
+        profile_url = reverse(
+            'posts:profile', kwargs={'username': 'Old Name'})
+        self.client.get(group_url)
+        self.client.get(profile_url)
+        group.slug = 'new_slug'
+        group.save()
+        author.username = 'New Name'
+        author.save()
+        self.assertEqual(self.client.get(group_url).status_code, 404)
+        self.assertEqual(self.client.get(profile_url).status_code, 404)
+
+    def test_keys_with_spaces(self):
+        """Ключи с пробелами не дробятся и годятся для кеша"""
+        url = reverse(
+            'posts:profile', kwargs={'username': 'Other Author'})
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            response = self.client.get(url)
+            self.assertIn(
+                'author:Other%20Author', response['Surrogate-Key'].split())
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'HIT')
+            self.other_post.text = 'edited_other_post'
+            self.other_post.save()
+            response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'edited_other_post')
+
+    def test_stats_endpoint(self):
+        """Счётчики кеша доступны персоналу"""
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        staff = User.objects.create(username='staff', is_staff=True)
+        client = Client()
+        client.force_login(staff)
+        stats = client.get(reverse('page_cache_stats')).json()
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreaterEqual(stats['misses'], 1)
+        self.assertGreaterEqual(stats['purges'], 1)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='Conditional Author')
+        cls.group = Group.objects.create(
+            title='test_group',
+            slug='conditional_slug',
+            description='test_description',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='test_text_post',
+            group=cls.group,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+        )
+
+    def test_not_modified_without_rendering(self):
+        """Неизменившаяся страница отдаётся 304 без рендера шаблона"""
+        client = Client()
+        client.force_login(self.user)
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = client.get(url)
+                self.assertIn('Last-Modified', response)
+                response = client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse(response.templates)
+
+    def test_changes_modify_pages(self):
+        """Новый комментарий меняет ETag страниц поста и автора"""
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий')
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_on_new_login(self):
+        """После нового входа страница с формами не отдаётся по 304"""
+        User.objects.filter(pk=self.user.pk).update(
+            password=make_password('password'))
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        client = Client()
+        login = {'username': self.user.username, 'password': 'password'}
+        client.post(reverse('users:login'), login)
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        client.post(reverse('users:logout'))
+        client.post(reverse('users:login'), login)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        """Авторизованный пользователь не получает 304 по ETag анонима"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        etag = self.client.get(url)['ETag']
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_page_not_modified(self):
+        """Страница из полностраничного кеша тоже отвечает 304"""
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailQueueTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='Thumbnail Author')
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='test_text_post',
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=PostsPagesTests.small_gif,
+                content_type='image/gif'
+            )
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.id})
+
+    def test_signed_url_until_generated(self):
+        """Пока миниатюры нет, шаблон ссылается на адрес нарезки, не режа её"""
+        thumbnail_url = reverse('posts:thumbnail', kwargs={'token': 'x'})
+        prefix = thumbnail_url[:thumbnail_url.index('x/')]
+        with mock.patch.object(thumbnails, 'get_or_generate') as generate:
+            response = self.client.get(self.url)
+        generate.assert_not_called()
+        self.assertContains(response, prefix)
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertNotContains(response, 'thumbnail-placeholder')
+        thumbnails.generate(self.post.image, thumbnails.geometries())
+        response = self.client.get(self.url)
+        self.assertNotContains(response, prefix)
+        self.assertContains(response, '<img class="card-img my-2"')
+
+    def test_responsive_variants(self):
+        """Пост выводится через srcset всех ширин, WebP - если умеет Pillow"""
+        thumbnails.generate(self.post.image, thumbnails.geometries())
+        response = self.client.get(self.url)
+        for width in settings.THUMBNAIL_WIDTHS:
+            with self.subTest(width=width):
+                self.assertContains(response, f' {width}w')
+        self.assertContains(response, 'width="960" height="339"')
+        webp = any(
+            options['format'] == 'WEBP'
+            for _, options in thumbnails.geometries())
+        self.assertEqual('type="image/webp"' in response.content.decode(),
+                         webp)
+
+    def test_schedule_deduplicates(self):
+        """Одна и та же миниатюра не ставится в очередь дважды"""
+        with mock.patch.object(transaction, 'on_commit') as on_commit:
+            thumbnails.schedule(self.post.image)
+            thumbnails.schedule(self.post.image)
+        self.assertEqual(on_commit.call_count, 1)
+
+    def test_feed_thumbnails_loaded_in_one_query(self):
+        """Метаданные миниатюр ленты читаются из БД одним запросом"""
+        for i in range(3):
+            post = Post.objects.create(
+                author=self.user, text='test_text_post',
+                image=f'posts/batched_{i}.gif')
+            thumbnail = default.backend.thumbnail_file(
+                post.image, '960x339', {'crop': 'center', 'upscale': True})
+            thumbnail.set_size((960, 339))
+            default.kvstore.set(thumbnail)
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('posts:index'))
+        kvstore_queries = [
+            query for query in context.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+        self.assertContains(response, '<img class="card-img my-2"', 4)
+
+    def test_thumbnail_view_generates_once(self):
+        """Адрес нарезки режет миниатюру при первом запросе и только раз"""
+        geometry, options = thumbnails.geometries()[-1]
+        url = thumbnails.signed_url(self.post.image, geometry, options)
+        generate = mock.patch.object(
+            ThumbnailBackend, 'get_thumbnail', autospec=True,
+            side_effect=ThumbnailBackend.get_thumbnail)
+        with generate as get_thumbnail:
+            first = self.client.get(url)
+            second = self.client.get(url)
+        self.assertEqual(get_thumbnail.call_count, 1)
+        for response in (first, second):
+            with self.subTest(response=response):
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'image/jpeg')
+                self.assertIn('immutable', response['Cache-Control'])
+                self.assertIn('public', response['Cache-Control'])
+        self.assertIsNotNone(
+            default.backend.get_ready(self.post.image, geometry, **options))
+
+    def test_thumbnail_view_rejects_bad_signature(self):
+        """Адрес с испорченной подписью или без исходника отдаёт 404"""
+        geometry, options = thumbnails.geometries()[-1]
+        url = thumbnails.signed_url(self.post.image, geometry, options)
+        missing = thumbnails.signed_url('posts/missing.gif', geometry, options)
+        for url in (url.rstrip('/') + 'x/', missing):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_thumbnail_view_sendfile(self):
+        """С SENDFILE_HEADER файл отдаёт фронтовой сервер"""
+        geometry, options = thumbnails.geometries()[-1]
+        url = thumbnails.signed_url(self.post.image, geometry, options)
+        with self.settings(SENDFILE_HEADER='X-Accel-Redirect'):
+            response = self.client.get(url)
+        thumbnail = default.backend.get_ready(
+            self.post.image, geometry, **options)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            settings.SENDFILE_URL + thumbnail.name)
+        self.assertEqual(response.content, b'')
+        with self.settings(SENDFILE_HEADER='X-Sendfile'):
+            response = self.client.get(url)
+        self.assertEqual(
+            response['X-Sendfile'], thumbnail.storage.path(thumbnail.name))
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='Search Author')
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user, text=f'Котики и собаки, заметка {i}')
+            for i in range(12)
+        ]
+        cls.best = Post.objects.create(
+            author=cls.user, text='Котики, котики и ещё раз котики')
+        cls.other = Post.objects.create(
+            author=cls.user, text='Про <script>погоду</script>')
+        cls.url = reverse('posts:search')
+
+    def search(self, query, **params):
+        response = self.client.get(self.url, {'q': query, **params})
+        return response, response.context['page_obj']
+
+    def test_ranked_and_highlighted(self):
+        """Выдача ранжирована по bm25, совпадения подсвечены и экранированы"""
+        response, page_obj = self.search('котики')
+        self.assertEqual(page_obj[0], self.best)
+        self.assertContains(response, '<mark>Котики</mark>')
+        response, page_obj = self.search('погод')
+        self.assertEqual(list(page_obj), [self.other])
+        self.assertContains(response, '&lt;script&gt;<mark>погоду</mark>')
+
+    def test_keyset_pagination(self):
+        """Страницы выдачи листаются курсором по (rank, id) без повторов"""
+        response, first = self.search('котики')
+        self.assertContains(
+            response, f'?{urlencode({"q": "котики"})}&amp;cursor=')
+        _, second = self.search('котики', cursor=first.next_cursor)
+        _, back = self.search('котики', cursor=second.previous_cursor)
+        found = list(first) + list(second)
+        self.assertEqual(len(found), 13)
+        self.assertEqual(len(set(found)), 13)
+        self.assertIsNone(second.next_cursor)
+        self.assertEqual(list(back), list(first))
+        _, last = self.search('котики', page='99999999999999999999')
+        self.assertEqual(list(last), found[-10:])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Индекс обновляется при правке и удалении поста"""
+        post = Post.objects.create(author=self.user, text='Редкое слово')
+        self.assertEqual(list(self.search('редкое')[1]), [post])
+        post.text = 'Другое слово'
+        post.save()
+        self.assertEqual(list(self.search('редкое')[1]), [])
+        self.assertEqual(list(self.search('другое')[1]), [post])
+        post.delete()
+        self.assertEqual(list(self.search('другое')[1]), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        """Операторы FTS5 в запросе не ломают поиск"""
+        for query in ('"', 'котики OR', 'NEAR(', '*', ''):
+            with self.subTest(query=query):
+                response = self.client.get(self.url, {'q': query})
+                self.assertEqual(response.status_code, 200)
+
+    def test_admin_uses_index(self):
+        """Поиск в админке идёт по индексу, а не LIKE по тексту"""
+        admin = User.objects.create_superuser(
+            'search_admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'погоду'})
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.other])
+        self.assertFalse(any(
+            'LIKE' in query['sql'] for query in context.captured_queries))
+
+
+@mock.patch.object(transaction, 'on_commit', lambda func: func())
+class AutocompleteTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.ivan = User.objects.create(
+            username='ivan_p', first_name='Иван', last_name='Петров')
+        cls.ivanova = User.objects.create(
+            username='masha', first_name='Мария', last_name='Иванова')
+        cls.group = Group.objects.create(
+            title='Котоводы', slug='cats', description='test_description')
+        cls.url = reverse('posts:autocomplete')
+
+    def setUp(self):
+        cache.clear()
+        autocomplete._index = None
+
+    def values(self, query):
+        response = self.client.get(self.url, {'q': query})
+        return [result['value'] for result in response.json()['results']]
+
+    def test_prefix_and_substring(self):
+        """Короткий запрос ищет по началу слов, длинный - по подстроке"""
+        self.assertEqual(self.values('ив'), ['ivan_p', 'masha'])
+        self.assertEqual(self.values('ванов'), ['masha'])
+        self.assertEqual(self.values('КОТО'), ['cats'])
+        self.assertEqual(self.values('нет такого'), [])
+        response = self.client.get(self.url, {'q': 'cats'})
+        self.assertEqual(response.json()['results'][0]['url'],
+                         reverse('posts:group_list', args=['cats']))
+
+    def test_updated_incrementally(self):
+        """Изменения применяются к индексу процесса без пересборки"""
+        autocomplete.get_index()
+        with mock.patch.object(autocomplete, 'build') as build:
+            user = User.objects.create(username='fedya', first_name='Фёдор')
+            self.assertEqual(self.values('федо'), ['fedya'])
+            self.group.title = 'Собаководы'
+            self.group.save()
+            self.assertEqual(self.values('кото'), [])
+            user.delete()
+            self.assertEqual(self.values('федо'), [])
+        build.assert_not_called()
+
+    def test_foreign_changes_replayed(self):
+        """Изменения другого процесса догоняются по журналу без пересборки"""
+        stale = autocomplete.build()
+        User.objects.create(username='fedya', first_name='Фёдор')
+        Group.objects.filter(pk=self.group.pk).delete()
+        autocomplete._index = stale
+        with mock.patch.object(autocomplete, 'build') as build:
+            self.assertEqual(self.values('федо'), ['fedya'])
+            self.assertEqual(self.values('кото'), [])
+        build.assert_not_called()
+
+    def test_rebuilt_without_change_log(self):
+        """Если журнал изменений вытеснен из кеша, индекс пересобирается"""
+        autocomplete.get_index()
+        User.objects.filter(pk=self.ivan.pk).update(first_name='Игорь')
+        cache.set(autocomplete.VERSION_KEY, 1, None)
+        self.assertEqual(self.values('игор'), ['ivan_p'])
+
+    def test_warm_survives_missing_tables(self):
+        """Прогрев без готовой базы откладывает сборку до запроса"""
+        with mock.patch.object(
+                autocomplete, 'build', side_effect=DatabaseError):
+            with self.assertLogs('posts.autocomplete', 'WARNING'):
+                autocomplete.warm()
+        self.assertIsNone(autocomplete._index)
+        self.assertEqual(self.values('ив'), ['ivan_p', 'masha'])
+
+    def test_login_does_not_invalidate(self):
+        """Вход пользователя не меняет версию индекса"""
+        self.ivan.set_password('password')
+        self.ivan.save()
+        version = cache.get(autocomplete.VERSION_KEY)
+        self.client.login(username='ivan_p', password='password')
+        self.assertEqual(cache.get(autocomplete.VERSION_KEY), version)
+
+
+class RelatedPostsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='related_author')
+        texts = [
+            'Кошки любят рыбу и тёплое молоко',
+            'Мои кошки едят рыбу каждый день',
+            'Собаки любят долгие прогулки в парке',
+            'Вечерние прогулки с собаки по парке',
+            'Рецепт борща со свёклой',
+            'Борща много не бывает',
+            'Ремонт велосипеда своими руками',
+            'Ремонт велосипеда в гараже',
+            'Поездка на море летом',
+            'Летом снова поедем на море',
+        ]
+        cls.posts = [
+            Post.objects.create(author=cls.user, text=text) for text in texts
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def neighbours(self, post):
+        return list(RelatedPost.objects.filter(
+            post=post).order_by('-score').values_list('related', flat=True))
+
+    def test_command_finds_similar_posts(self):
+        """Команда related_posts находит посты с общими словами"""
+        cats, kittens, dogs, walks = self.posts[:4]
+        call_command('related_posts', stdout=StringIO())
+        self.assertEqual(self.neighbours(cats)[0], kittens.pk)
+        self.assertEqual(self.neighbours(dogs)[0], walks.pk)
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': cats.pk}))
+        self.assertEqual(response.context['related_posts'][0], kittens)
+        self.assertContains(response, 'Похожие записи')
+
+    def test_refresh_is_incremental(self):
+        """Повторный запуск векторизует только новые посты"""
+        related.refresh(count=1)
+        cats = self.posts[0]
+        new = Post.objects.create(
+            author=self.user, text='Кошки обожают рыбу и молоко')
+        with mock.patch.object(
+                related, 'term_weights',
+                side_effect=related.term_weights) as term_weights:
+            stats = related.refresh(count=1)
+        self.assertEqual(term_weights.call_count, 1)
+        self.assertEqual(stats['vectorized'], 1)
+        self.assertEqual(stats['posts'], 1)
+        self.assertEqual(self.neighbours(cats)[0], new.pk)
+        self.assertIn(cats.pk, self.neighbours(new))
+
+    def test_vocabulary_follows_edits_and_deletes(self):
+        """Частоты слов в словаре следуют за правкой и удалением постов"""
+        related.refresh()
+        self.assertEqual(Term.objects.get(word='кошки').df, 2)
+        cats = self.posts[0]
+        cats.text = 'Про собак'
+        cats.save()
+        self.assertEqual(Term.objects.get(word='кошки').df, 1)
+        Post.objects.filter(pk=self.posts[1].pk).delete()
+        self.assertEqual(Term.objects.get(word='кошки').df, 0)
+        related.refresh()
+        self.assertEqual(Term.objects.get(word='собак').df, 1)
+
+    def test_edited_post_recomputed(self):
+        """Правка текста сбрасывает соседей поста до следующего запуска"""
+        related.refresh(count=1)
+        dogs, walks = self.posts[2:4]
+        self.assertEqual(self.neighbours(walks), [dogs.pk])
+        dogs.text = 'Свёкла для борща'
+        dogs.save()
+        self.assertEqual(self.neighbours(dogs), [])
+        self.assertEqual(self.neighbours(walks), [])
+        self.assertEqual(related.refresh(count=1)['posts'], 2)
+        self.assertIn(self.posts[4].pk, self.neighbours(dogs))
+        self.assertNotIn(dogs.pk, self.neighbours(walks))
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(
+            username='api_author', first_name='Api', last_name='Author')
+        cls.reader = User.objects.create(username='api_reader')
+        cls.group = Group.objects.create(
+            title='api_group', slug='api_slug', description='test')
+        Follow.objects.create(user=cls.reader, author=cls.user)
+        cls.posts = [
+            Post.objects.create(
+                author=cls.user, group=cls.group, text=f'api post {i}')
+            for i in range(13)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feeds(self):
+        """JSON-ленты отдают посты с автором и группой и курсор дальше"""
+        urls = [
+            reverse('api_v1:index'),
+            reverse('api_v1:group_list', args=[self.group.slug]),
+            reverse('api_v1:profile', args=[self.user.username]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                data = self.client.get(url).json()
+                self.assertEqual(len(data['results']), 10)
+                first = data['results'][0]
+                self.assertEqual(first['id'], self.posts[-1].pk)
+                self.assertEqual(first['author'], {
+                    'id': self.user.pk,
+                    'username': 'api_author',
+                    'full_name': 'Api Author',
+                })
+                self.assertEqual(first['group']['slug'], 'api_slug')
+                self.assertIsNone(data['previous'])
+                second = self.client.get(data['next']).json()
+                self.assertEqual(len(second['results']), 3)
+                self.assertIsNone(second['next'])
+
+    def test_sparse_fieldsets(self):
+        """?fields= оставляет только нужные поля и переживает курсор"""
+        url = reverse('api_v1:index')
+        data = self.client.get(url, {'fields': 'id,text'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'text'})
+        self.assertIn('fields=id%2Ctext', data['next'])
+        response = self.client.get(url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_one_query_per_page(self):
+        """Автор и группа приходят тем же запросом, что и посты"""
+        url = reverse('api_v1:index')
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+    def test_follow_requires_login(self):
+        """Лента подписок доступна только авторизованному"""
+        url = reverse('api_v1:follow_index')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_login(self.reader)
+        data = self.client.get(url).json()
+        self.assertEqual(data['results'][0]['id'], self.posts[-1].pk)
+
+    def test_posts_batch(self):
+        """Пачка постов по id одним запросом в порядке списка"""
+        ids = [self.posts[3].pk, self.posts[0].pk, 10 ** 6, self.posts[3].pk]
+        url = reverse('api_v1:posts_batch')
+        with self.assertNumQueries(1):
+            data = self.client.get(
+                url, {'ids': ','.join(map(str, ids)), 'fields': 'id,author'}
+            ).json()
+        self.assertEqual(
+            [post['id'] for post in data['results']],
+            [self.posts[3].pk, self.posts[0].pk])
+        self.assertEqual(data['results'][0]['author']['username'],
+                         'api_author')
+        self.assertEqual(data['missing'], [10 ** 6])
+        too_many = ','.join(map(str, range(api.BATCH_LIMIT + 1)))
+        for ids in ('1,x', '', too_many, '99999999999999999999', '0', '-1'):
+            with self.subTest(ids=ids[:10]):
+                response = self.client.get(url, {'ids': ids})
+                self.assertEqual(response.status_code, 400)
+
+    def test_missing_feed(self):
+        """Несуществующая группа - JSON с кодом 404"""
+        response = self.client.get(
+            reverse('api_v1:group_list', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.json())
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='export_author')
+        cls.other = User.objects.create(username='export_other')
+        cls.staff = User.objects.create(username='export_staff', is_staff=True)
+        cls.group = Group.objects.create(
+            title='export_group', slug='export_slug', description='test')
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='пост, с "кавычками"')
+        cls.foreign = Post.objects.create(author=cls.other, text='чужой')
+        cls.comment = Comment.objects.create(
+            author=cls.user, post=cls.foreign, text='комментарий')
+        cls.url = reverse('posts:profile_export', args=[cls.user.username])
+
+    def test_ndjson(self):
+        """NDJSON: строка на пост, затем строка на комментарий автора"""
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        rows = [orjson.loads(line) for line in lines]
+        self.assertEqual(
+            [(row['type'], row['id']) for row in rows],
+            [('post', self.post.pk), ('comment', self.comment.pk)])
+        self.assertEqual(rows[0]['group'], 'export_slug')
+        self.assertEqual(rows[0]['text'], self.post.text)
+        self.assertEqual(rows[1]['post'], self.foreign.pk)
+
+    def test_csv(self):
+        """CSV: заголовок и экранированные строки"""
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertIn('attachment; filename="export_author.csv"',
+                      response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode()
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(tuple(rows[0]), export.COLUMNS)
+        self.assertEqual(rows[1][:6], [
+            'post', str(self.post.pk), '', 'export_slug',
+            self.post.pub_date.isoformat(), self.post.text])
+        self.assertEqual(rows[2][:3], [
+            'comment', str(self.comment.pk), str(self.foreign.pk)])
+        response = self.client.get(self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_permissions(self):
+        """Выгрузку видят только сам автор и персонал"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        for user, status in ((self.other, 403), (self.staff, 200)):
+            with self.subTest(user=user.username):
+                self.client.force_login(user)
+                self.assertEqual(
+                    self.client.get(self.url).status_code, status)
+
+    def test_command(self):
+        """Команда пишет ту же выгрузку в stdout"""
+        out = StringIO()
+        call_command('export_author', 'export_author', stdout=out)
+        rows = [orjson.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['id'], self.post.pk)
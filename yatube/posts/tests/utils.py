@@ -0,0 +1,27 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+QUERY_BUDGETS = {
+    'posts:index': 3,
+    'posts:group_list': 5,
+    'posts:profile': 6,
+    'posts:post_detail': 6,
+    'posts:follow_index': 4,
+}
+
+
+class QueryBudgetMixin:
+    """Проверка, что страница укладывается в бюджет SQL-запросов."""
+
+    def assertQueryBudget(self, client, url_name, kwargs=None):
+        budget = QUERY_BUDGETS[url_name]
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(reverse(url_name, kwargs=kwargs))
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url_name}: {len(queries)} запросов при бюджете {budget}\n'
+            + '\n'.join(queries)
+        )
+        return response
@@ -0,0 +1,267 @@
+import functools
+import hashlib
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import get_module_class
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE, KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.stampede import get_or_compute
+
+from . import feed_cache
+from .models import Post
+from .signals import purge_post_pages
+
+QUEUED_KEY = 'thumbnail:queued:{}'
+QUEUED_TIMEOUT = 60
+GENERATED_KEY = 'thumbnail:generated:{}'
+GENERATED_TIMEOUT = 60 * 60
+SIGNING_SALT = 'posts.thumbnails'
+
+logger = logging.getLogger(__name__)
+_executor = None
+
+
+class QueuedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, который не режет картинки во время рендера.
+
+    Готовая миниатюра берётся из kvstore. Отсутствующая ставится в
+    очередь фонового пула, а шаблон получает None и ссылается на
+    ``signed_url()`` или показывает заглушку из ``{% empty %}``.
+    """
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        thumbnail = self.get_ready(file_, geometry_string, **options)
+        if thumbnail is None:
+            schedule(file_, [(geometry_string, options)])
+        return thumbnail
+
+    def get_ready(self, file_, geometry_string, **options):
+        """Миниатюра из kvstore или None, если её ещё не нарезали."""
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, options))
+
+    def thumbnail_file(self, file_, geometry_string, options):
+        """ImageFile миниатюры; вычисляется без обращений к хранилищам.
+
+        Вычисление имени дороже самого поиска в kvstore, поэтому
+        результат запоминается в процессе.
+        """
+        return _thumbnail_file(
+            getattr(file_, 'name', file_), getattr(file_, 'storage', None),
+            geometry_string, tuple(sorted(options.items())))
+
+
+@functools.lru_cache(maxsize=4096)
+def _thumbnail_file(name, storage, geometry_string, options):
+    """Имя миниатюры по правилам sorl; бэкенд здесь не хранит состояния."""
+    backend = ThumbnailBackend()
+    options = dict(options)
+    source = ImageFile(name, storage)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry_string, options)
+    return ImageFile(name, default.storage)
+
+
+class PreloadingKVStore(KVStore):
+    """kvstore sorl-thumbnail с пакетной загрузкой метаданных страницы.
+
+    Внутри ``preloaded()`` первое обращение к хранилищу забирает записи
+    всех миниатюр страницы одним get_many из общего кеша и одним
+    запросом к БД для промахов. Остальные ``{% thumbnail %}`` берут
+    их из памяти потока. Если страница пришла из кеша фрагментов,
+    загрузка не выполняется вовсе.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    @contextmanager
+    def preloaded(self, image_files):
+        self._local.pending = [add_prefix(file.key) for file in image_files]
+        self._local.values = {}
+        try:
+            yield
+        finally:
+            self._local.pending = []
+            self._local.values = {}
+
+    def _load(self, keys):
+        values = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            rows = dict(KVStoreModel.objects.filter(
+                key__in=missing).values_list('key', 'value'))
+            found = {key: rows.get(key, EMPTY_VALUE) for key in missing}
+            self.cache.set_many(found, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(found)
+        return values
+
+    def _get_raw(self, key):
+        pending = getattr(self._local, 'pending', None)
+        if pending:
+            self._local.values.update(self._load(pending))
+            self._local.pending = []
+        values = getattr(self._local, 'values', {})
+        if key not in values:
+            return super()._get_raw(key)
+        value = values[key]
+        return None if value == EMPTY_VALUE else value
+
+    def _set_raw(self, key, value):
+        getattr(self._local, 'values', {}).pop(key, None)
+        super()._set_raw(key, value)
+
+    def _delete_raw(self, *keys):
+        for key in keys:
+            getattr(self._local, 'values', {}).pop(key, None)
+        super()._delete_raw(*keys)
+
+
+def geometries():
+    """Размеры из THUMBNAIL_GEOMETRIES в форматах, доступных Pillow.
+
+    Pillow, собранный без libwebp, не пишет WebP: такие варианты
+    пропускаются, и в srcset остаётся только JPEG.
+    """
+    Image.init()
+    return [
+        (geometry, options)
+        for geometry, options in settings.THUMBNAIL_GEOMETRIES
+        if options.get('format', sorl_settings.THUMBNAIL_FORMAT) in Image.SAVE
+    ]
+
+
+def preloaded(posts):
+    """Контекст рендера страницы с пакетной загрузкой миниатюр постов."""
+    files = [
+        default.backend.thumbnail_file(post.image, geometry, options)
+        for post in posts if post.image
+        for geometry, options in geometries()
+    ]
+    return default.kvstore.preloaded(files)
+
+
+def _variant_hash(source, geometry, options):
+    payload = f'{source.key}|{geometry}|{sorted(options.items())}'
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def signed_url(file_, geometry, options):
+    """Адрес миниатюры, которую ``views.thumbnail`` нарежет по запросу.
+
+    Имя картинки и параметры подписываются, поэтому по такому адресу
+    нельзя заказать произвольный размер или чужой файл.
+    """
+    token = signing.dumps(
+        [ImageFile(file_).name, geometry, options],
+        salt=SIGNING_SALT, compress=True)
+    return reverse('posts:thumbnail', kwargs={'token': token})
+
+
+def unsign(token):
+    """Имя, геометрия и опции из адреса; BadSignature для поддельного."""
+    return signing.loads(token, salt=SIGNING_SALT)
+
+
+def get_or_generate(file_, geometry, options):
+    """Готовая миниатюра или нарезанная сейчас; None без исходника.
+
+    Нарезка идёт под блокировкой ``get_or_compute``: одновременные
+    запросы одной миниатюры ждут первый, а не режут её каждый сам.
+    """
+    source = ImageFile(file_)
+    thumbnail = default.backend.get_ready(source, geometry, **options)
+    if thumbnail is not None:
+        return thumbnail
+    if not source.exists():
+        return None
+    name = get_or_compute(
+        GENERATED_KEY.format(_variant_hash(source, geometry, options)),
+        lambda: ThumbnailBackend().get_thumbnail(
+            source, geometry, **options).name,
+        GENERATED_TIMEOUT)
+    return ImageFile(name, default.storage)
+
+
+def schedule(file_, variants=None):
+    """Ставит нарезку миниатюр картинки в очередь после коммита.
+
+    По умолчанию режутся все варианты из ``geometries()``.
+    Размер, уже стоящий в очереди любого процесса, повторно не ставится.
+    """
+    source = ImageFile(file_)
+    pending = [
+        (geometry, dict(options))
+        for geometry, options in variants or geometries()
+        if cache.add(
+            QUEUED_KEY.format(_variant_hash(source, geometry, options)),
+            True, QUEUED_TIMEOUT)
+    ]
+    if pending:
+        transaction.on_commit(lambda: _submit(source, pending))
+
+
+def _submit(source, geometries):
+    future = _get_executor().submit(
+        _generate, source.name, source.serialize_storage(), geometries)
+    future.add_done_callback(_log_failure)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            settings.THUMBNAIL_WORKERS, initializer=_init_worker)
+    return _executor
+
+
+def _init_worker():
+    django.setup()
+    connections.close_all()
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error(
+            'Не удалось нарезать миниатюры', exc_info=future.exception())
+
+
+def _generate(name, storage, geometries):
+    generate(ImageFile(name, get_module_class(storage)()), geometries)
+
+
+def generate(file_, geometries):
+    """Режет миниатюры и сбрасывает кеши страниц с этой картинкой."""
+    source = ImageFile(file_)
+    backend = ThumbnailBackend()
+    for geometry, options in geometries:
+        backend.get_thumbnail(source, geometry, **options)
+    posts = Post.objects.filter(image=source.name).select_related('author')
+    for post in posts:
+        feed_cache.bump_post_feeds(post.author_id, post.group_id)
+        purge_post_pages(post, post.group_id)
@@ -0,0 +1,165 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import F, Q
+
+from .models import AuthorCounters, Follow, Post, Timeline
+from .paginator import CursorPaginator, keyset_slice
+
+BATCH_SIZE = 500
+TIMELINE_KEYS = ('feed_pub_date', 'feed_post')
+POST_KEYS = ('pub_date', 'pk')
+
+
+def is_pulled(author_id):
+    """Посты автора с большим числом подписчиков читаются при запросе.
+
+    Строка счётчиков здесь не создаётся: функция вызывается и из
+    сигналов, в том числе пока автор удаляется каскадом.
+    """
+    followers = AuthorCounters.objects.filter(
+        author_id=author_id).values_list('followers_count', flat=True).first()
+    if followers is None:
+        followers = Follow.objects.filter(author_id=author_id).count()
+    return followers > settings.FEED_FANOUT_THRESHOLD
+
+
+def pulled_authors(user):
+    """Авторы из подписок пользователя, чьи посты читаются при запросе.
+
+    Кроме популярных авторов сюда попадают подписки, в ленту которых
+    разложены не все посты автора: оформленные или пропустившие посты,
+    пока автор был выше порога. Они читаются так до ``materialize()``.
+    """
+    return list(Follow.objects.filter(user=user).filter(
+        Q(author__counters__followers_count__gt=(
+            settings.FEED_FANOUT_THRESHOLD))
+        | Q(materialized=False)
+    ).values_list('author_id', flat=True))
+
+
+def push_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_pulled(post.author_id):
+        Follow.objects.filter(
+            author_id=post.author_id, materialized=True
+        ).update(materialized=False)
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика все посты автора."""
+    if not is_pulled(author_id):
+        fill(user_id, author_id)
+
+
+def fill(user_id, author_id):
+    posts = Post.objects.filter(
+        author_id=author_id).values_list('pk', 'pub_date')
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    Follow.objects.filter(
+        user_id=user_id, author_id=author_id).update(materialized=True)
+
+
+def materialize():
+    """Дораскладывает неполные ленты подписок на авторов ниже порога.
+
+    Такие подписки остаются после того, как автор вернулся ниже
+    FEED_FANOUT_THRESHOLD, и до этого читаются при запросе. Заполнять
+    их в запросе на отписку значило бы тысячи вставок в одном запросе,
+    поэтому это делает ``rebuild_timelines --incomplete``.
+    Возвращает число заполненных подписок.
+    """
+    follows = Follow.objects.filter(materialized=False).exclude(
+        author__counters__followers_count__gt=(
+            settings.FEED_FANOUT_THRESHOLD)
+    ).values_list('user_id', 'author_id')
+    follows = list(follows)
+    for user_id, author_id in follows:
+        fill(user_id, author_id)
+    return len(follows)
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты подписчика посты автора."""
+    Timeline.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def rebuild():
+    """Перестраивает все ленты с нуля, возвращает число записей."""
+    Timeline.objects.all().delete()
+    Follow.objects.update(materialized=False)
+    follows = Follow.objects.values_list('user_id', 'author_id')
+    for user_id, author_id in follows.iterator():
+        backfill(user_id, author_id)
+    return Timeline.objects.count()
+
+
+def feed(user):
+    """Посты ленты подписок пользователя в порядке Timeline.
+
+    Ключ ленты берётся из строк Timeline самого пользователя через
+    аннотации: фильтр курсора по ``timeline__...`` в отдельном
+    ``filter()`` добавил бы второй JOIN со строками всех читателей.
+    """
+    return Post.objects.filter(timeline__user=user).annotate(
+        feed_pub_date=F('timeline__pub_date'),
+        feed_post=F('timeline__post'),
+    ).select_related('author', 'group').order_by(
+        '-feed_pub_date', '-feed_post')
+
+
+class HybridFeedPaginator(CursorPaginator):
+    """Лента подписок: push из Timeline плюс pull популярных авторов.
+
+    Посты авторов, у которых подписчиков больше FEED_FANOUT_THRESHOLD,
+    не копируются в Timeline при публикации. Вместо этого при чтении
+    поток каждого такого автора берётся по индексу (author, -pub_date)
+    и сливается с материализованной лентой k-путевым слиянием по куче.
+    """
+
+    def __init__(self, object_list, per_page, pulled=(), **kwargs):
+        kwargs.setdefault('keys', TIMELINE_KEYS)
+        self.pulled = pulled
+        super().__init__(object_list, per_page, **kwargs)
+
+    def _fetch(self, descending=True, after=None, offset=0):
+        if not self.pulled:
+            return super()._fetch(descending, after, offset)
+        stop = offset + self.per_page + 1
+        streams = [keyset_slice(
+            self.object_list, self.keys, descending, after, 0, stop)]
+        for author_id in self.pulled:
+            streams.append(keyset_slice(
+                Post.objects.filter(
+                    author_id=author_id).select_related('author', 'group'),
+                POST_KEYS, descending, after, 0, stop))
+        merged = heapq.merge(
+            *streams,
+            key=lambda post: (post.pub_date, post.pk),
+            reverse=descending)
+        return list(islice(unique_posts(merged), offset, stop))
+
+
+def unique_posts(posts):
+    """Отбрасывает повторы поста, попавшего и в Timeline, и в pull."""
+    seen = set()
+    for post in posts:
+        if post.pk not in seen:
+            seen.add(post.pk)
+            yield post
@@ -0,0 +1,111 @@
+import base64
+import io
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+MIN_JPEG_QUALITY = 50
+JPEG_QUALITY_STEP = 10
+SHRINK_FACTOR = 0.75
+PLACEHOLDER_SIZE = (16, 6)
+
+
+def normalize_image(upload):
+    """Приводит загруженную картинку к ограничениям до сохранения.
+
+    Картинка поворачивается по EXIF, уменьшается до
+    POST_IMAGE_MAX_DIMENSIONS и перекодируется без метаданных:
+    с прозрачностью в PNG, остальное в прогрессивный JPEG. Если
+    результат больше POST_IMAGE_MAX_BYTES, сначала снижается качество,
+    затем размер. JPEG декодируется сразу в уменьшенном масштабе,
+    поэтому снимок с телефона не разворачивается в памяти целиком.
+    """
+    if upload.size > settings.POST_IMAGE_MAX_UPLOAD_BYTES:
+        raise ValidationError(
+            'Файл слишком большой: не больше %(limit)s.',
+            code='file_too_large',
+            params={
+                'limit': filesizeformat(settings.POST_IMAGE_MAX_UPLOAD_BYTES)
+            },
+        )
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+        if image.width * image.height > settings.POST_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Слишком большое разрешение картинки.',
+                code='too_many_pixels')
+        image.draft('RGB', settings.POST_IMAGE_MAX_DIMENSIONS)
+        image = ImageOps.exif_transpose(image)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Не удалось прочитать картинку.', code='invalid_image')
+    image.thumbnail(settings.POST_IMAGE_MAX_DIMENSIONS, Image.LANCZOS)
+    if has_alpha(image):
+        image, image_format = image.convert('RGBA'), 'PNG'
+    else:
+        image, image_format = image.convert('RGB'), 'JPEG'
+    quality = settings.POST_IMAGE_QUALITY
+    data = encode(image, image_format, quality)
+    while len(data) > settings.POST_IMAGE_MAX_BYTES and image.width > 1:
+        if image_format == 'JPEG' and quality > MIN_JPEG_QUALITY:
+            quality -= JPEG_QUALITY_STEP
+        else:
+            image = image.resize((
+                max(int(image.width * SHRINK_FACTOR), 1),
+                max(int(image.height * SHRINK_FACTOR), 1),
+            ), Image.LANCZOS)
+        data = encode(image, image_format, quality)
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    extension = 'png' if image_format == 'PNG' else 'jpg'
+    return SimpleUploadedFile(
+        f'{name}.{extension}', data,
+        content_type=f'image/{image_format.lower()}')
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+
+
+def encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        image.save(
+            buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def image_placeholder(image):
+    """Размытое превью картинки поста как data URI, '' без картинки.
+
+    PNG 16x6 с тем же кадрированием, что у миниатюр 960x339, занимает
+    около 300 байт и растягивается браузером до размеров карточки.
+    """
+    if not image:
+        return ''
+    close = image.closed
+    try:
+        image.open()
+        return placeholder_uri(image)
+    except (OSError, SuspiciousFileOperation, Image.DecompressionBombError):
+        return ''
+    finally:
+        if close:
+            image.close()
+        else:
+            image.seek(0)
+
+
+def placeholder_uri(content):
+    image = Image.open(content)
+    image.draft('RGB', PLACEHOLDER_SIZE)
+    preview = ImageOps.fit(image.convert('RGB'), PLACEHOLDER_SIZE, Image.BOX)
+    data = base64.b64encode(encode(preview, 'PNG', None)).decode()
+    return f'data:image/png;base64,{data}'
@@ -1,50 +1,113 @@
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.core import signing
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import (Http404, HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
+from django.views.decorators.http import require_safe
+from sorl.thumbnail.images import ImageFile
 
+from core.page_cache import tag
+from core.sendfile import send_file
+
+from . import autocomplete, export, thumbnails
+from .counters import counters_for
+from .feed_cache import (INDEX_FEED, cached_page, conditional_feed,
+                         feed_version, group_feed, page_surrogate_keys,
+                         post_surrogate_keys, profile_feed)
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
+from .paginator import paginate
+from .related import related_posts
+from .search import SearchPaginator, match_query
+from .timeline import HybridFeedPaginator, feed, pulled_authors
 
 POSTS_PER_PAGE = 10
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def index_version(request):
+    return feed_version(INDEX_FEED)
+
+
+def group_version(request, slug):
+    group_id = Group.objects.filter(
+        slug=slug).values_list('pk', flat=True).first()
+    return group_id and feed_version(group_feed(group_id))
+
+
+def profile_version(request, username):
+    author_id = User.objects.filter(
+        username=username).values_list('pk', flat=True).first()
+    return author_id and feed_version(profile_feed(author_id))
+
 
+def post_version(request, post_id):
+    author_id = Post.objects.filter(
+        pk=post_id).values_list('author_id', flat=True).first()
+    return author_id and feed_version(profile_feed(author_id))
 
+
+@conditional_feed(index_version)
 def index(request):
     template = 'posts/index.html'
     title = 'Это главная страница проекта Yatube'
-    post_list = Post.objects.order_by('-pub_date')
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = Post.objects.select_related('author', 'group')
+    version = feed_version(INDEX_FEED)
+    page_obj = cached_page(
+        request,
+        version,
+        lambda: paginate(request, post_list, POSTS_PER_PAGE)
+    )
     context = {
         'title': title,
         'page_obj': page_obj,
+        'feed_version': version,
     }
-    return render(request, template, context)
+    with thumbnails.preloaded(page_obj):
+        response = render(request, template, context)
+    return tag(response, 'feed:index', *page_surrogate_keys(page_obj))
 
 
+@conditional_feed(group_version)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.order_by('-pub_date')
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = group.posts.select_related('author', 'group')
+    version = feed_version(group_feed(group.pk))
+    page_obj = cached_page(
+        request,
+        version,
+        lambda: paginate(request, post_list, POSTS_PER_PAGE)
+    )
     template = 'posts/group_list.html'
     title = group.title
     context = {
         'title': title,
         'group': group,
         'page_obj': page_obj,
+        'feed_version': version,
     }
-    return render(request, template, context)
+    with thumbnails.preloaded(page_obj):
+        response = render(request, template, context)
+    return tag(
+        response, f'group:{group.slug}', *page_surrogate_keys(page_obj))
 
 
+@conditional_feed(profile_version)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.order_by('-pub_date')
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    post_count = author.posts.count()
+    author = get_object_or_404(
+        User.objects.select_related('counters'), username=username)
+    post_list = author.posts.select_related('author', 'group')
+    version = feed_version(profile_feed(author.pk))
+    page_obj = cached_page(
+        request,
+        version,
+        lambda: paginate(request, post_list, POSTS_PER_PAGE)
+    )
+    counters = counters_for(author)
     template = 'posts/profile.html'
     full_name = author.get_full_name()
     title = 'Профайл пользователя ' + full_name
@@ -54,22 +117,46 @@ def profile(request, username):
     context = {
         'title': title,
         'page_obj': page_obj,
-        'post_count': post_count,
+        'post_count': counters.posts_count,
+        'followers_count': counters.followers_count,
         'full_name': full_name,
         'author': author,
-        'following': following
+        'following': following,
+        'feed_version': version,
     }
-    return render(request, template, context)
+    with thumbnails.preloaded(page_obj):
+        response = render(request, template, context)
+    return tag(
+        response, f'author:{author.username}', *page_surrogate_keys(page_obj))
 
 
+@login_required
+def profile_export(request, username):
+    author = get_object_or_404(User, username=username)
+    if request.user != author and not request.user.is_staff:
+        raise PermissionDenied
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in export.FORMATS:
+        return HttpResponseBadRequest(
+            f'Формат выгрузки: {", ".join(export.FORMATS)}')
+    response = StreamingHttpResponse(
+        export.export(author, export_format),
+        content_type=export.CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = (
+        f'attachment; filename="{author.username}.{export_format}"')
+    return response
+
+
+@conditional_feed(post_version)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('group', 'author__counters'), pk=post_id)
     post_date = post.pub_date
     post_author = post.author.get_full_name
-    post_count = post.author.posts.count()
+    post_count = counters_for(post.author).posts_count
     template = 'posts/post_detail.html'
     form = CommentForm()
-    comments = post.comment.all()
+    comments = post.comment.select_related('author').order_by('created')
     context = {
         'post': post,
         'title': post.text[:30],
@@ -77,12 +164,51 @@ def post_detail(request, post_id):
         'post_count': post_count,
         'post_date': post_date,
         'form': form,
-        'comments': comments
+        'comments': comments,
+        'related_posts': related_posts(post),
+    }
+    with thumbnails.preloaded([post]):
+        response = render(request, template, context)
+    return tag(response, *post_surrogate_keys(post))
+
+
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = paginate(
+        request, match_query(query), POSTS_PER_PAGE,
+        paginator_class=SearchPaginator)
+    context = {
+        'query': query,
+        'query_prefix': urlencode({'q': query}) + '&',
+        'page_obj': page_obj,
     }
-    return render(request, template, context)
+    return render(request, 'posts/search.html', context)
+
+
+def autocomplete_names(request):
+    return JsonResponse(
+        {'results': autocomplete.search(request.GET.get('q', ''))})
+
+
+@require_safe
+def thumbnail(request, token):
+    try:
+        name, geometry, options = thumbnails.unsign(token)
+    except signing.BadSignature:
+        raise Http404
+    storage = Post._meta.get_field('image').storage
+    image = thumbnails.get_or_generate(
+        ImageFile(name, storage), geometry, options)
+    if image is None:
+        raise Http404
+    response = send_file(image.storage, image.name)
+    patch_cache_control(
+        response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
 
 
 @login_required
+@transaction.atomic
 def post_create(request):
     form = PostForm(
         request.POST or None,
@@ -92,6 +218,8 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        if post.image:
+            thumbnails.schedule(post.image)
         return redirect('posts:profile', username=request.user)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -107,7 +235,9 @@ def post_edit(request, post_id):
     if request.user != post.author:
         return redirect('posts:post_detail', post_id=post_id)
     if form.is_valid():
-        form.save()
+        post = form.save()
+        if 'image' in form.changed_data and post.image:
+            thumbnails.schedule(post.image)
         return redirect('posts:post_detail', post_id=post_id)
     is_edit = True
     context = {
@@ -118,6 +248,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
@@ -133,24 +264,26 @@ def add_comment(request, post_id):
 def follow_index(request):
     template = 'posts/follow.html'
     title = 'Последние обновления в ваших подписках'
-    post_list = Post.objects.filter(
-        author__following__user=request.user).order_by('-pub_date')
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(
+        request,
+        feed(request.user),
+        POSTS_PER_PAGE,
+        paginator_class=HybridFeedPaginator,
+        pulled=pulled_authors(request.user)
+    )
     context = {
         'title': title,
         'page_obj': page_obj,
     }
-    return render(request, template, context)
+    with thumbnails.preloaded(page_obj):
+        return render(request, template, context)
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    if ((not Follow.objects.filter(
-            user=request.user, author=author).exists())
-            and request.user != author):
+    if request.user != author:
         Follow.objects.get_or_create(
             user=request.user,
             author=author
@@ -159,16 +292,15 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author_f = get_object_or_404(User, username=username)
-    old_follow = Follow.objects.filter(
-        user=request.user, author=author_f)
-    if old_follow.exists():
-        old_follow.delete()
+    Follow.objects.filter(user=request.user, author=author_f).delete()
     return redirect('posts:profile', username=username)
 
 
 @login_required
+@transaction.atomic
 def post_delite(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     if request.user == post.author:
@@ -45,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'core.middleware.AnonymousPageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -124,14 +125,52 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 'X-Accel-Redirect' (nginx) или 'X-Sendfile' (Apache, lighttpd)
+SENDFILE_HEADER = None
+SENDFILE_URL = '/protected-media/'
+
+
+CACHE_LOCATION = os.getenv(
+    'CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache.sqlite3'))
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': CACHE_LOCATION,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
     }
 }
 
 
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+
+FEED_FANOUT_THRESHOLD = 1000
+
+
+THUMBNAIL_BACKEND = 'posts.thumbnails.QueuedThumbnailBackend'
+THUMBNAIL_KVSTORE = 'posts.thumbnails.PreloadingKVStore'
+THUMBNAIL_WIDTHS = [480, 960, 1440]
+THUMBNAIL_FORMATS = ['WEBP', 'JPEG']
+THUMBNAIL_GEOMETRIES = [
+    (f'{width}x{width * 339 // 960}',
+     {'crop': 'center', 'upscale': True, 'format': image_format})
+    for width in THUMBNAIL_WIDTHS
+    for image_format in THUMBNAIL_FORMATS
+]
+THUMBNAIL_WORKERS = 2
+
+
+POST_IMAGE_MAX_DIMENSIONS = (2560, 2560)
+POST_IMAGE_MAX_PIXELS = 50 * 10 ** 6
+POST_IMAGE_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+POST_IMAGE_MAX_BYTES = 1024 * 1024
+POST_IMAGE_QUALITY = 85
+
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES
+
+# Тесты очищают кеш, поэтому работают со своим файлом, а не с общим
+CACHES['default']['LOCATION'] = os.path.join(
+    tempfile.gettempdir(), 'yatube-test-cache.sqlite3')